@@ -4,8 +4,17 @@ AI analysis module: sends images to Ollama vision model for description and tagg
 import os
 import json
 import base64
+import functools
+import gzip
 import logging
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional
+import imagehash
 import requests
+from requests.adapters import HTTPAdapter
 from PIL import Image
 import io
 
@@ -15,103 +24,257 @@ import scanner
 
 logger = logging.getLogger(__name__)
 
+# Shared HTTP session so every Ollama call reuses a pooled keep-alive connection
+_SESSION = requests.Session()
+_POOL_SIZE = max(10, config.ANALYZE_CONCURRENCY)
+_ADAPTER = HTTPAdapter(pool_connections=10, pool_maxsize=_POOL_SIZE, max_retries=0)
+_SESSION.mount("http://", _ADAPTER)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip, deflate"})
 
-def image_to_base64(filepath: str, max_dim: int = None) -> str:
-    """Load image, optionally resize, and convert to base64."""
+# Error reported when no Ollama endpoint accepts connections; stops batch runs
+OLLAMA_UNREACHABLE = "Cannot connect to Ollama. Is it running?"
+
+# Prompt templates, built once at import
+_VISION_INSTRUCTIONS = """Analyze this image and provide:
+1. A detailed description (2-3 sentences) of what you see.
+2. A list of relevant tags/keywords for searching (10-20 tags).
+
+"""
+_VISION_FORMAT = """Respond in this exact JSON format only, no other text:
+{"description": "your description here", "tags": ["tag1", "tag2", "tag3"]}"""
+_VISION_PROMPT = _VISION_INSTRUCTIONS + _VISION_FORMAT
+_VISION_PROMPT_CTX = (_VISION_INSTRUCTIONS + "Additional context: {context}\n\n"
+                      + _VISION_FORMAT.replace("{", "{{").replace("}", "}}"))
+
+_REFINE_PROMPT = """Given this image analysis, refine the description and tags for better searchability.
+
+Filename: {filename}
+Current description: {description}
+Current tags: {tags}
+
+Improve the description to be more specific and useful.
+Add any missing relevant tags and remove irrelevant ones.
+Suggest a clearer filename if the current one is unclear (or keep it if it's already good).
+
+Respond in this exact JSON format only:
+{{"description": "refined description", "tags": ["tag1", "tag2"], "suggested_filename": "suggested_name.ext"}}"""
+
+# Video frames whose perceptual hashes are this close to a kept frame are skipped
+_FRAME_DUPLICATE_DISTANCE = 4
+
+# In-flight request counts per Ollama base URL, for least-connections balancing
+_INFLIGHT = {}
+_INFLIGHT_LOCK = threading.Lock()
+
+
+def close_session():
+    """Close pooled Ollama connections (call on process exit)."""
+    _SESSION.close()
+
+
+def _acquire_endpoint(exclude=()) -> str:
+    """
+    Pick the Ollama endpoint with the fewest in-flight requests and claim a slot.
+    Endpoints in `exclude` are skipped unless nothing else is left.
+    """
+    with _INFLIGHT_LOCK:
+        candidates = [u for u in config.OLLAMA_BASE_URLS if u not in exclude] or config.OLLAMA_BASE_URLS
+        url = min(candidates, key=lambda u: _INFLIGHT.get(u, 0))
+        _INFLIGHT[url] = _INFLIGHT.get(url, 0) + 1
+    return url
+
+
+def _release_endpoint(url: str):
+    with _INFLIGHT_LOCK:
+        _INFLIGHT[url] -= 1
+
+
+def _encode_payload(payload: dict) -> bytes:
+    """
+    Serialize a generate request to a JSON body. Base64 images are spliced in
+    as-is (they need no escaping) instead of being re-encoded by json.dumps.
+    """
+    images = payload.get("images")
+    if not images:
+        return json.dumps(payload).encode("utf-8")
+    head = json.dumps({k: v for k, v in payload.items() if k != "images"}).encode("utf-8")
+    quoted = b",".join(b'"' + (img.encode("ascii") if isinstance(img, str) else img) + b'"'
+                       for img in images)
+    return head[:-1] + b', "images": [' + quoted + b"]}"
+
+
+def _read_response(resp) -> str:
+    """
+    Collect the text of a streamed generate response. Reading stops as soon as
+    a complete JSON object has been produced, so an over-long answer doesn't
+    keep the model generating; otherwise everything up to "done" is returned.
+    """
+    parts = []
+    seen = 0
+    depth = 0
+    start = None
+    in_string = escaped = False
+    for line in resp.iter_lines():
+        if not line:
+            continue
+        chunk = json.loads(line)
+        piece = chunk.get("response", "")
+        parts.append(piece)
+        for i, c in enumerate(piece, seen):
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif c == "\\":
+                    escaped = True
+                elif c == '"':
+                    in_string = False
+            elif c == '"' and depth:
+                in_string = True
+            elif c == "{":
+                if not depth:
+                    start = i
+                depth += 1
+            elif c == "}" and depth:
+                depth -= 1
+                if not depth:
+                    text = "".join(parts)
+                    try:
+                        if isinstance(json.loads(text[start:i + 1]), dict):
+                            return text[:i + 1]
+                    except json.JSONDecodeError:
+                        pass
+        seen += len(piece)
+        if chunk.get("done"):
+            break
+    return "".join(parts)
+
+
+def _generate(payload: dict, timeout: int) -> str:
+    """
+    POST a generate request to the least-busy Ollama endpoint and return the response text.
+    A refused connection fails over to the next endpoint; only once every endpoint has
+    refused is the round retried with exponential backoff, up to config.OLLAMA_MAX_RETRIES.
+    """
+    body = _encode_payload(payload)
+    headers = {"Content-Type": "application/json"}
+    if config.OLLAMA_GZIP_REQUESTS:
+        # Base64 JPEG text compresses back by roughly the 33% it inflated
+        body = gzip.compress(body, compresslevel=5)
+        headers["Content-Encoding"] = "gzip"
+    endpoints = set(config.OLLAMA_BASE_URLS)
+    for attempt in range(config.OLLAMA_MAX_RETRIES + 1):
+        refused = set()
+        while refused != endpoints:
+            url = _acquire_endpoint(exclude=refused)
+            try:
+                resp = _SESSION.post(f"{url}/api/generate", data=body, timeout=timeout,
+                                     headers=headers, stream=True)
+                try:
+                    resp.raise_for_status()
+                    return _read_response(resp)
+                finally:
+                    # Closing early also tells Ollama to stop generating
+                    resp.close()
+            except requests.exceptions.ConnectionError as e:
+                logger.warning("Cannot connect to Ollama at %s: %s", url, e)
+                refused.add(url)
+                last_error = e
+            finally:
+                _release_endpoint(url)
+
+        if attempt == config.OLLAMA_MAX_RETRIES:
+            raise last_error
+        logger.warning("No Ollama endpoint reachable, retrying (%d/%d)",
+                       attempt + 1, config.OLLAMA_MAX_RETRIES)
+        time.sleep(2 ** attempt)
+
+
+def image_to_base64(filepath: str, max_dim: int = None) -> bytes:
+    """Load image, optionally resize, and convert to base64 (ASCII bytes)."""
     if not os.path.exists(filepath):
         raise FileNotFoundError(f"Image file not found: {filepath}")
     max_dim = max_dim or config.MAX_IMAGE_DIM
-    img = Image.open(filepath)
+    with Image.open(filepath) as img:
+        # Let libjpeg decode straight at 1/2, 1/4 or 1/8 scale when the source is
+        # much larger than needed (no-op for non-JPEG formats)
+        img.draft("RGB", (max_dim, max_dim))
 
-    # Convert RGBA/P to RGB
-    if img.mode in ("RGBA", "P"):
-        img = img.convert("RGB")
+        # Palette images can't be resampled with LANCZOS
+        if img.mode == "P":
+            img = img.convert("RGB")
 
-    # Resize if needed
-    w, h = img.size
-    if max(w, h) > max_dim:
-        ratio = max_dim / max(w, h)
-        img = img.resize((int(w * ratio), int(h * ratio)), Image.LANCZOS)
+        # Resize if needed
+        w, h = img.size
+        if max(w, h) > max_dim:
+            ratio = max_dim / max(w, h)
+            img = img.resize((int(w * ratio), int(h * ratio)), Image.LANCZOS)
 
-    buf = io.BytesIO()
-    img.save(buf, format="JPEG", quality=85)
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
+        # JPEG only takes L/RGB/CMYK; convert the (now smaller) RGBA, LA, I;16, ... images
+        if img.mode not in ("RGB", "L"):
+            img = img.convert("RGB")
 
+        buf = io.BytesIO()
+        img.save(buf, format="JPEG", quality=85)
+    return base64.b64encode(buf.getbuffer())
 
-def analyze_with_vision(image_b64: str, context: str = "") -> dict:
+
+def analyze_with_vision(image_b64: bytes, context: str = "") -> dict:
     """
     Send image to Ollama vision model. Returns dict with 'description' and 'tags'.
     """
-    prompt = f"""Analyze this image and provide:
-1. A detailed description (2-3 sentences) of what you see.
-2. A list of relevant tags/keywords for searching (10-20 tags).
-
-{f"Additional context: {context}" if context else ""}
-
-Respond in this exact JSON format only, no other text:
-{{"description": "your description here", "tags": ["tag1", "tag2", "tag3"]}}"""
+    prompt = _VISION_PROMPT_CTX.format(context=context) if context else _VISION_PROMPT
 
     try:
-        resp = requests.post(
-            f"{config.OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": config.VISION_MODEL,
-                "prompt": prompt,
-                "images": [image_b64],
-                "stream": False,
-                "options": {"temperature": 0.3},
-            },
-            timeout=120,
-        )
-        resp.raise_for_status()
-        result_text = resp.json().get("response", "")
+        result_text = _generate({
+            "model": config.VISION_MODEL,
+            "prompt": prompt,
+            "images": [image_b64],
+            "stream": True,
+            "options": {"temperature": 0.3},
+        }, timeout=120)
 
         # Try to parse JSON from response
         return parse_ai_response(result_text)
 
     except requests.exceptions.ConnectionError:
-        return {"description": "[Error: Cannot connect to Ollama. Is it running?]", "tags": []}
+        return {"description": f"[Error: {OLLAMA_UNREACHABLE}]", "tags": [],
+                "error": OLLAMA_UNREACHABLE}
     except Exception as e:
-        return {"description": f"[Error: {str(e)}]", "tags": []}
+        return {"description": f"[Error: {str(e)}]", "tags": [], "error": str(e)}
 
 
 def refine_with_text_model(description: str, tags: list, filename: str) -> dict:
     """
     Optionally refine description/tags using a text model (e.g., deepseek-r1).
+    Identical requests within a process are answered from an in-memory cache.
     """
     if not config.TEXT_MODEL:
         return {"description": description, "tags": tags}
 
-    prompt = f"""Given this image analysis, refine the description and tags for better searchability.
-
-Filename: {filename}
-Current description: {description}
-Current tags: {json.dumps(tags)}
-
-Improve the description to be more specific and useful.
-Add any missing relevant tags and remove irrelevant ones.
-Suggest a clearer filename if the current one is unclear (or keep it if it's already good).
-
-Respond in this exact JSON format only:
-{{"description": "refined description", "tags": ["tag1", "tag2"], "suggested_filename": "suggested_name.ext"}}"""
-
     try:
-        resp = requests.post(
-            f"{config.OLLAMA_BASE_URL}/api/generate",
-            json={
-                "model": config.TEXT_MODEL,
-                "prompt": prompt,
-                "stream": False,
-                "options": {"temperature": 0.3},
-            },
-            timeout=180,
-        )
-        resp.raise_for_status()
-        result_text = resp.json().get("response", "")
-        return parse_ai_response(result_text)
+        refined = _refine_cached(config.TEXT_MODEL, description.strip(),
+                                 tuple(sorted(set(map(str, tags)))), filename)
     except (requests.RequestException, json.JSONDecodeError, KeyError) as e:
         logger.warning("Text model refinement failed: %s", e)
         return {"description": description, "tags": tags}
+    # Hand out copies so callers can't mutate the cached entry
+    return {**refined, "tags": list(refined["tags"])}
+
+
+@functools.lru_cache(maxsize=4096)
+def _refine_cached(model: str, description: str, tags: tuple, filename: str) -> dict:
+    """Text model call behind refine_with_text_model; raises on failure so errors aren't cached."""
+    prompt = _REFINE_PROMPT.format(filename=filename, description=description,
+                                   tags=json.dumps(list(tags)))
+
+    result_text = _generate({
+        "model": model,
+        "prompt": prompt,
+        "stream": True,
+        "options": {"temperature": 0.3},
+    }, timeout=180)
+    return parse_ai_response(result_text)
 
 
 def parse_ai_response(text: str) -> dict:
@@ -138,31 +301,58 @@ def parse_ai_response(text: str) -> dict:
     return {"description": text[:500], "tags": []}
 
 
-def analyze_file(conn, file_id: int) -> dict:
-    """Analyze a single file with the vision model."""
-    row = database.get_file_by_id(conn, file_id)
-    if not row:
-        return {"error": "File not found"}
+def _distinct_frames(frames: list) -> list:
+    """Keep frames that differ visibly from earlier ones; near-identical ones are deleted."""
+    kept, hashes = [], []
+    for frame_path in frames:
+        phash = scanner.compute_perceptual_hash(frame_path)
+        h = imagehash.hex_to_hash(phash) if phash else None
+        if h is not None and any(h - k <= _FRAME_DUPLICATE_DISTANCE for k in hashes):
+            try:
+                os.unlink(frame_path)
+            except OSError:
+                pass
+            continue
+        kept.append(frame_path)
+        if h is not None:
+            hashes.append(h)
+    return kept
+
 
-    filepath = row["filepath"]
+def analyze_path(filepath: str, file_type: str, filename: str, encode=image_to_base64) -> dict:
+    """
+    Run the vision (and optional text) model on a file without touching the database.
+    Safe to call from worker threads. `encode` turns an image path into base64.
+    """
     if not os.path.exists(filepath):
         return {"error": f"File not found on disk: {filepath}"}
 
-    if row["file_type"] == "image":
-        b64 = image_to_base64(filepath)
+    if file_type == "image":
+        b64 = encode(filepath)
         result = analyze_with_vision(b64)
-    elif row["file_type"] == "video":
+        if "error" in result:
+            return {"error": result["error"]}
+    elif file_type == "video":
         # Extract frames and analyze each, then combine
         frames = scanner.extract_video_frames(filepath, config.VIDEO_SAMPLE_FRAMES)
         if not frames:
             return {"error": "Could not extract frames from video"}
+        # Static scenes yield near-identical frames; analyze each view once
+        frames = _distinct_frames(frames)
 
         descriptions = []
         all_tags = set()
+        unreachable = False
         for frame_path in frames:
             try:
-                b64 = image_to_base64(frame_path)
+                if unreachable:
+                    continue
+                b64 = encode(frame_path)
                 r = analyze_with_vision(b64, context="This is a frame from a video.")
+                if "error" in r:
+                    logger.warning("Failed to analyze video frame %s: %s", frame_path, r["error"])
+                    unreachable = r["error"] == OLLAMA_UNREACHABLE
+                    continue
                 if r.get("description"):
                     descriptions.append(r["description"])
                 all_tags.update(r.get("tags", []))
@@ -174,66 +364,266 @@ def analyze_file(conn, file_id: int) -> dict:
                 except OSError:
                     pass
 
-        result = {
-            "description": " | ".join(descriptions) if descriptions else "Could not analyze video",
-            "tags": list(all_tags),
-        }
+        if unreachable:
+            return {"error": OLLAMA_UNREACHABLE}
+        if not descriptions:
+            return {"error": "Could not analyze video"}
+        result = {"description": " | ".join(descriptions), "tags": list(all_tags)}
     else:
         return {"error": "Unknown file type"}
 
     # Optionally refine with text model
     if config.TEXT_MODEL:
         refined = refine_with_text_model(
-            result["description"], result["tags"], row["filename"]
+            result["description"], result["tags"], filename
         )
         result.update(refined)
 
-    # Update database
-    update_data = {
-        "filepath": filepath,
+    return result
+
+
+def _cache_model() -> str:
+    """Cache key for the models that produce a stored analysis."""
+    if config.TEXT_MODEL:
+        return f"{config.VISION_MODEL}+{config.TEXT_MODEL}"
+    return config.VISION_MODEL
+
+
+def _with_hash(conn, row) -> dict:
+    """
+    Return the file row as a dict, hashing the file first if the scan left
+    file_hash empty (files of unique size are not hashed during a scan, but
+    the analysis cache is keyed on content hash).
+    """
+    row = dict(row)
+    if not row["file_hash"]:
+        row["file_hash"] = _try_hash(row["filepath"])
+        if row["file_hash"]:
+            conn.execute("UPDATE files SET file_hash = ? WHERE id = ?", (row["file_hash"], row["id"]))
+    return row
+
+
+def _try_hash(filepath: str) -> Optional[str]:
+    """Content hash of a file, or None if it is missing or unreadable."""
+    if not os.path.exists(filepath):
+        return None
+    try:
+        return scanner.compute_file_hash(filepath)
+    except OSError as e:
+        logger.warning("Could not hash %s: %s", filepath, e)
+        return None
+
+
+def _hash_and_analyze(row: dict, cached_hashes: set, **kwargs):
+    """
+    Worker-thread task for analyze_all_unprocessed: hash the file if the scan
+    left file_hash empty, then run the model unless that content is already
+    in the analysis cache. Returns (file_hash, result); result is None for
+    a cache hit.
+    """
+    file_hash = row["file_hash"]
+    if not file_hash:
+        file_hash = _try_hash(row["filepath"])
+        if file_hash in cached_hashes:
+            return file_hash, None
+    return file_hash, analyze_path(row["filepath"], row["file_type"], row["filename"], **kwargs)
+
+
+def _reuse_analysis(conn, row) -> Optional[dict]:
+    """Return an earlier analysis of identical (or duplicate) content, or None."""
+    if not os.path.exists(row["filepath"]):
+        return None
+
+    if row["file_hash"]:
+        cached = database.get_cached_analysis(conn, row["file_hash"], _cache_model())
+        if cached:
+            return cached
+
+    if row["is_duplicate"] and row["duplicate_of"]:
+        original = database.get_file_by_id(conn, row["duplicate_of"])
+        if original and original["ai_analyzed"]:
+            try:
+                tags = json.loads(original["tags"]) if original["tags"] else []
+            except (json.JSONDecodeError, TypeError):
+                tags = []
+            return {"description": original["description"], "tags": tags}
+
+    return None
+
+
+def save_analysis(conn, row, result: dict, cache: bool = True):
+    """Store an analysis result for a file row (caller commits)."""
+    database.upsert_file(conn, {
+        "filepath": row["filepath"],
         "description": result["description"],
         "tags": result.get("tags", []),
         "ai_analyzed": 1,
-    }
-    database.upsert_file(conn, update_data)
+    })
+    # Only real analyses are cached; a failed run must be retried next time
+    if cache and row["file_hash"] and "error" not in result:
+        database.cache_analysis(
+            conn, row["file_hash"], _cache_model(), result["description"], result.get("tags", [])
+        )
+
+
+def analyze_file(conn, file_id: int, use_cache: bool = True) -> dict:
+    """
+    Analyze a single file with the vision model.
+    With use_cache, a stored analysis of identical content is reused instead.
+    """
+    row = database.get_file_by_id(conn, file_id)
+    if not row:
+        return {"error": "File not found"}
+    row = _with_hash(conn, row)
 
-    # Rename file if suggested and different
-    suggested = result.get("suggested_filename")
-    if suggested and suggested != row["filename"]:
-        result["suggested_filename"] = suggested
+    result = _reuse_analysis(conn, row) if use_cache else None
+    if result is not None:
+        save_analysis(conn, row, result, cache=False)
+    else:
+        result = analyze_path(row["filepath"], row["file_type"], row["filename"])
+        if "error" in result:
+            return result
+        save_analysis(conn, row, result)
 
     conn.commit()
     return result
 
 
 def analyze_all_unprocessed(conn, progress_callback=None):
-    """Analyze all files that haven't been processed by AI yet."""
-    rows = conn.execute(
-        "SELECT id, filepath FROM files WHERE ai_analyzed = 0 AND is_junk = 0"
-    ).fetchall()
+    """
+    Analyze all files that haven't been processed by AI yet.
+
+    Model calls run on a thread pool of config.ANALYZE_CONCURRENCY workers;
+    results are written back on the calling thread since sqlite3 connections
+    must not be shared across threads. Files whose contents were analyzed
+    before are served from the analysis cache without a model call.
+    Writes are committed every config.BATCH_SIZE files. If Ollama becomes
+    unreachable the run stops early and results["aborted"] is set.
+    """
+    # Files the scan didn't hash are hashed later on the worker threads, so
+    # a large backlog starts analyzing at once instead of hashing up front
+    rows = [dict(row) for row in conn.execute(
+        "SELECT id, filepath, filename, file_type, file_hash, is_duplicate, duplicate_of "
+        "FROM files WHERE ai_analyzed = 0 AND is_junk = 0"
+    ).fetchall()]
 
     total = len(rows)
-    results = {"processed": 0, "errors": 0, "total": total}
-
-    for i, row in enumerate(rows):
-        try:
-            r = analyze_file(conn, row["id"])
-            if "error" in r:
-                results["errors"] += 1
-            else:
-                results["processed"] += 1
-        except Exception as e:
-            logger.warning("Failed to analyze file ID %d: %s", row["id"], e)
-            results["errors"] += 1
-
+    results = {"processed": 0, "errors": 0, "total": total, "aborted": False}
+    if not total:
+        return results
+
+    done = 0
+    pending = []
+    for row in rows:
+        cached = _reuse_analysis(conn, row)
+        if cached is None:
+            pending.append(row)
+            continue
+        save_analysis(conn, row, cached, cache=False)
+        results["processed"] += 1
+        done += 1
+        if done % config.BATCH_SIZE == 0:
+            conn.commit()
         if progress_callback:
-            progress_callback(i + 1, total)
+            progress_callback(done, total)
+
+    if not pending:
+        conn.commit()
+        return results
+
+    # Identical content only needs one model call per run: group rows by
+    # hash, folding duplicates into their original's group when the
+    # original is analyzed in this same run. Unhashed rows have a size no
+    # other file shares (the scan hashes shared sizes), so they can't be
+    # identical to another row and stay in groups of their own.
+    keys = {row["id"]: row["file_hash"] or row["id"] for row in pending}
+    groups = {}
+    for row in pending:
+        key = keys[row["id"]]
+        if row["is_duplicate"] and row["duplicate_of"] in keys:
+            key = keys[row["duplicate_of"]]
+        groups.setdefault(key, []).append(row)
+
+    cached_hashes = {r[0] for r in conn.execute(
+        "SELECT file_hash FROM vision_cache WHERE model = ?", (_cache_model(),))}
+    workers = max(1, min(config.ANALYZE_CONCURRENCY, len(groups)))
+    queue = iter(groups.values())
+    futures = {}
+
+    # Optionally hand CPU-bound image encoding to worker processes; the
+    # analysis threads then only wait on them and on Ollama
+    procs = None
+    extra = {}
+    if config.PREPROCESS_WORKERS > 0:
+        procs = ProcessPoolExecutor(max_workers=config.PREPROCESS_WORKERS,
+                                    mp_context=multiprocessing.get_context("spawn"))
+        extra["encode"] = lambda path: procs.submit(image_to_base64, path).result()
+
+    def submit_next(pool):
+        if results["aborted"]:
+            return
+        group = next(queue, None)
+        if group is not None:
+            future = pool.submit(_hash_and_analyze, group[0], cached_hashes, **extra)
+            futures[future] = group
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            # Keep a small window of queued work instead of one future per file,
+            # so memory stays flat however large the backlog is
+            for _ in range(workers * 2):
+                submit_next(pool)
+
+            while futures:
+                finished, _ = wait(futures, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    group = futures.pop(future)
+                    lead = group[0]
+                    cache = True
+                    try:
+                        file_hash, r = future.result()
+                    except Exception as e:
+                        logger.warning("Failed to analyze file ID %d: %s", lead["id"], e)
+                        file_hash, r = None, {"error": str(e)}
+
+                    if file_hash and not lead["file_hash"]:
+                        lead["file_hash"] = file_hash
+                        conn.execute("UPDATE files SET file_hash = ? WHERE id = ?",
+                                     (file_hash, lead["id"]))
+                    if r is None:
+                        r = database.get_cached_analysis(conn, file_hash, _cache_model())
+                        cache = False
+
+                    if "error" in r and r["error"] == OLLAMA_UNREACHABLE and not results["aborted"]:
+                        # Every endpoint refused: don't grind through the backlog
+                        logger.error("Ollama unreachable, stopping analysis run")
+                        results["aborted"] = True
+
+                    for i, row in enumerate(group):
+                        if "error" in r:
+                            results["errors"] += 1
+                        else:
+                            save_analysis(conn, row, r, cache=cache and i == 0)
+                            results["processed"] += 1
+                        done += 1
+                        if done % config.BATCH_SIZE == 0:
+                            conn.commit()
+                        if progress_callback:
+                            progress_callback(done, total)
+                    submit_next(pool)
+    finally:
+        if procs:
+            procs.shutdown()
 
+    conn.commit()
     return results
 
 
-def rename_file(conn, file_id: int, new_name: str) -> dict:
-    """Rename a file on disk and update the database."""
+def rename_file(conn, file_id: int, new_name: str, commit: bool = True) -> dict:
+    """
+    Rename a file on disk and update the database.
+    Pass commit=False when renaming in bulk; the caller then commits.
+    """
     row = database.get_file_by_id(conn, file_id)
     if not row:
         return {"error": "File not found in database"}
@@ -260,7 +650,8 @@ def rename_file(conn, file_id: int, new_name: str) -> dict:
     new_path = os.path.join(directory, new_name)
 
     # Verify the resolved path stays within the same directory
-    if os.path.dirname(os.path.abspath(new_path)) != os.path.dirname(os.path.abspath(old_path)):
+    parent = os.path.dirname(os.path.abspath(old_path))
+    if os.path.dirname(os.path.abspath(new_path)) != parent:
         return {"error": "Invalid filename: path escapes parent directory"}
 
     if os.path.exists(new_path):
@@ -276,5 +667,6 @@ def rename_file(conn, file_id: int, new_name: str) -> dict:
         "UPDATE files SET filepath = ?, filename = ? WHERE id = ?",
         (new_path, new_name, file_id)
     )
-    conn.commit()
+    if commit:
+        conn.commit()
     return {"success": True, "old_path": old_path, "new_path": new_path}
@@ -56,7 +56,7 @@ def cmd_analyze(args):
 
     if args.id:
         print(f"Analyzing file ID {args.id}...")
-        result = ai_analyzer.analyze_file(conn, args.id)
+        result = ai_analyzer.analyze_file(conn, args.id, use_cache=False)
         if "error" in result:
             print(f"Error: {result['error']}")
         else:
@@ -66,7 +66,7 @@ def cmd_analyze(args):
                 print(f"Suggested filename: {result['suggested_filename']}")
     else:
         print(f"Analyzing unprocessed files with {config.VISION_MODEL}...")
-        print(f"Ollama URL: {config.OLLAMA_BASE_URL}")
+        print(f"Ollama URL: {', '.join(config.OLLAMA_BASE_URLS)}")
         print("This may take a while depending on the number of files and model speed.\n")
 
         def progress(current, total):
@@ -78,6 +78,8 @@ def cmd_analyze(args):
         print(f"  Total to process: {results['total']}")
         print(f"  Processed:        {results['processed']}")
         print(f"  Errors:           {results['errors']}")
+        if results["aborted"]:
+            print("  Stopped early: cannot connect to Ollama. Is it running?")
 
     conn.close()
 
@@ -193,10 +195,10 @@ def cmd_rename(args):
 
 def cmd_web(args):
     """Start web UI."""
-    from web_ui import app
+    from web_ui import serve
     print(f"Starting web UI at http://{config.WEB_HOST}:{config.WEB_PORT}")
     print("Press Ctrl+C to stop.\n")
-    app.run(host=config.WEB_HOST, port=config.WEB_PORT, debug=False)
+    serve()
 
 
 def format_size(size_bytes):
@@ -266,7 +268,10 @@ def main():
         parser.print_help()
         return
 
-    args.func(args)
+    try:
+        args.func(args)
+    finally:
+        ai_analyzer.close_session()
 
 
 if __name__ == "__main__":
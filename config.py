@@ -7,6 +7,17 @@ import os
 # --- Ollama Settings ---
 OLLAMA_BASE_URL = "http://localhost:11434"
 
+# All Ollama instances to spread requests over (least in-flight requests wins).
+# Add more URLs to use several machines on the LAN.
+OLLAMA_BASE_URLS = [OLLAMA_BASE_URL]
+
+# Retries (with exponential backoff) when an Ollama endpoint refuses connections
+OLLAMA_MAX_RETRIES = 3
+
+# Gzip request bodies (Content-Encoding: gzip). Ollama itself does not accept
+# compressed requests; only enable this behind a proxy that decompresses them
+OLLAMA_GZIP_REQUESTS = False
+
 # Vision model for analyzing images (MUST be a vision-capable model)
 # Options: llava, llava:13b, llava:34b, llava-llama3, bakllava, moondream
 VISION_MODEL = "llava"
@@ -29,6 +40,10 @@ VIDEO_EXTENSIONS = {
     ".m4v", ".mpg", ".mpeg", ".3gp",
 }
 
+# Worker processes for metadata extraction and hashing during scans
+# (None = one per CPU). Several files hash in parallel, one per worker
+SCAN_WORKERS = None
+
 # Files smaller than this (in bytes) are flagged as potential junk
 JUNK_SIZE_THRESHOLD = 10_000  # 10 KB
 
@@ -39,6 +54,17 @@ DB_PATH = os.path.join(os.path.dirname(__file__), "photo_tagger.db")
 WEB_HOST = "127.0.0.1"
 WEB_PORT = 8899
 
+# Requests the web UI handles at once when served by waitress
+WEB_THREADS = 8
+
+# Generated thumbnails are kept here and reused until the source file changes
+THUMB_DIR = os.path.join(os.path.dirname(__file__), "thumbnails")
+
+# Behind nginx, the URL prefix of an `internal` location aliased to the
+# filesystem root (e.g. "/_originals"); original files are then sent by nginx
+# via X-Accel-Redirect instead of through Python. None serves them directly.
+WEB_ACCEL_REDIRECT = None
+
 # --- Processing ---
 # Max dimension to resize images before sending to vision model (saves memory/time)
 MAX_IMAGE_DIM = 1024
@@ -46,5 +72,13 @@ MAX_IMAGE_DIM = 1024
 # Number of frames to extract from video for analysis
 VIDEO_SAMPLE_FRAMES = 3
 
+# Number of files analyzed concurrently (match Ollama's OLLAMA_NUM_PARALLEL)
+ANALYZE_CONCURRENCY = 4
+
+# Worker processes for image decode/resize/encode during batch analysis.
+# 0 encodes on the analysis threads; raise it (e.g. os.cpu_count()) when slow
+# decoders such as RAW/HEIC plugins keep the CPU busy
+PREPROCESS_WORKERS = 0
+
 # Batch size for processing (how many files before committing to DB)
 BATCH_SIZE = 10
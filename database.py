@@ -14,11 +14,37 @@ def get_db_path():
     return config.DB_PATH
 
 
+# Bytes of the database file SQLite may memory-map per connection
+_MMAP_SIZE = 256 << 20
+
+
+def _connect(db_path, check_same_thread=True):
+    """Open a connection with row access by name and WAL journaling."""
+    conn = sqlite3.connect(db_path, check_same_thread=check_same_thread)
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers (web UI) run during writes; NORMAL sync is safe under WAL
+    # and avoids an fsync on every commit
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # Sorts and temp indexes (GROUP BY in find_duplicates, get_all_tags) stay
+    # in RAM, and reads go through a memory map instead of read() syscalls
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute(f"PRAGMA mmap_size={_MMAP_SIZE}")
+    return conn
+
+
+# Copies the text tags of `new` into file_tags (invalid JSON yields no tags)
+_TAGS_INSERT_SQL = """
+            INSERT OR IGNORE INTO file_tags (file_id, tag)
+            SELECT new.id, LOWER(TRIM(je.value))
+            FROM json_each(CASE WHEN json_valid(new.tags) THEN new.tags ELSE '[]' END) je
+            WHERE je.type = 'text' AND TRIM(je.value) != '';"""
+
+
 def init_db(db_path=None):
     """Initialize the database schema."""
     db_path = db_path or get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    conn = _connect(db_path)
     c = conn.cursor()
 
     # Main files table
@@ -49,6 +75,17 @@ def init_db(db_path=None):
         )
     """)
 
+    # Cache of model output keyed by file contents, so moved/duplicate files skip the model
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS vision_cache (
+            file_hash TEXT NOT NULL,
+            model TEXT NOT NULL,
+            description TEXT,
+            tags TEXT,  -- JSON array
+            PRIMARY KEY (file_hash, model)
+        )
+    """)
+
     # Full-text search virtual table
     c.execute("""
         CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5(
@@ -82,12 +119,59 @@ def init_db(db_path=None):
         END
     """)
 
+    # Normalized copy of each file's tags, kept in sync by triggers so tag
+    # queries don't have to parse the JSON column
+    new_tags_table = not c.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name='file_tags'"
+    ).fetchone()
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS file_tags (
+            file_id INTEGER NOT NULL,
+            tag TEXT NOT NULL,
+            PRIMARY KEY (file_id, tag)
+        ) WITHOUT ROWID
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_ft_tag ON file_tags(tag)")
+
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS file_tags_ai AFTER INSERT ON files BEGIN
+            {_TAGS_INSERT_SQL}
+        END
+    """)
+
+    c.execute("""
+        CREATE TRIGGER IF NOT EXISTS file_tags_ad AFTER DELETE ON files BEGIN
+            DELETE FROM file_tags WHERE file_id = old.id;
+        END
+    """)
+
+    c.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS file_tags_au AFTER UPDATE OF tags ON files BEGIN
+            DELETE FROM file_tags WHERE file_id = old.id;
+            {_TAGS_INSERT_SQL}
+        END
+    """)
+
+    if new_tags_table:
+        # Existing database: fill the table from the JSON column once
+        c.execute("""
+            INSERT OR IGNORE INTO file_tags (file_id, tag)
+            SELECT f.id, LOWER(TRIM(je.value))
+            FROM files f, json_each(CASE WHEN json_valid(f.tags) THEN f.tags ELSE '[]' END) je
+            WHERE je.type = 'text' AND TRIM(je.value) != ''
+        """)
+
     # Indexes
     c.execute("CREATE INDEX IF NOT EXISTS idx_file_hash ON files(file_hash)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_phash ON files(perceptual_hash)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_file_type ON files(file_type)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_is_duplicate ON files(is_duplicate)")
     c.execute("CREATE INDEX IF NOT EXISTS idx_is_junk ON files(is_junk)")
+    # Partial index holding only the files still waiting for AI analysis
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_files_todo ON files(ai_analyzed, is_junk)
+        WHERE ai_analyzed = 0 AND is_junk = 0
+    """)
 
     conn.commit()
     return conn
@@ -97,8 +181,7 @@ def init_db(db_path=None):
 def get_connection(db_path=None):
     """Context manager for database connections."""
     db_path = db_path or get_db_path()
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row
+    conn = _connect(db_path)
     try:
         yield conn
         conn.commit()
@@ -109,39 +192,103 @@ def get_connection(db_path=None):
         conn.close()
 
 
-def upsert_file(conn, file_data: dict):
-    """Insert or update a file record."""
-    existing = conn.execute(
-        "SELECT id FROM files WHERE filepath = ?", (file_data["filepath"],)
-    ).fetchone()
+def connect(db_path=None, check_same_thread=True):
+    """
+    Open a long-lived connection; the caller commits and closes it. Pass
+    check_same_thread=False for connections handed between threads (one
+    thread at a time), such as a web server's connection pool.
+    """
+    return _connect(db_path or get_db_path(), check_same_thread)
 
-    if existing:
-        file_id = existing["id"]
-        sets = []
-        vals = []
-        for k, v in file_data.items():
-            if k != "filepath":
-                sets.append(f"{k} = ?")
-                vals.append(json.dumps(v) if isinstance(v, (list, dict)) else v)
-        vals.append(file_data["filepath"])
-        conn.execute(
-            f"UPDATE files SET {', '.join(sets)} WHERE filepath = ?", vals
-        )
-        return file_id
-    else:
-        cols = list(file_data.keys())
-        vals = []
-        for v in file_data.values():
-            vals.append(json.dumps(v) if isinstance(v, (list, dict)) else v)
-        placeholders = ", ".join(["?"] * len(cols))
-        cur = conn.execute(
-            f"INSERT INTO files ({', '.join(cols)}) VALUES ({placeholders})", vals
-        )
-        return cur.lastrowid
+
+# Columns without a default that an INSERT must supply
+_REQUIRED_COLUMNS = {"filepath", "filename", "file_type"}
+
+
+def _db_value(v):
+    return json.dumps(v) if isinstance(v, (list, dict)) else v
+
+
+# A scan leaves file_hash NULL when it didn't hash the file; the stored hash
+# (also the vision_cache key) is kept while size and mtime are unchanged
+_KEEP_HASH_SQL = (
+    "file_hash = CASE WHEN excluded.file_hash IS NOT NULL THEN excluded.file_hash "
+    "WHEN files.file_size IS excluded.file_size "
+    "AND files.modified_date IS excluded.modified_date THEN files.file_hash END"
+)
+
+
+def _upsert_sql(cols) -> str:
+    """Single-statement insert-or-update keyed on filepath for the given columns."""
+    keep_hash = {"file_hash", "file_size", "modified_date"}.issubset(cols)
+    updates = ", ".join(
+        _KEEP_HASH_SQL if k == "file_hash" and keep_hash else f"{k} = excluded.{k}"
+        for k in cols if k != "filepath"
+    )
+    return (
+        f"INSERT INTO files ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))}) "
+        f"ON CONFLICT(filepath) DO UPDATE SET {updates}"
+    )
 
 
-def search_files(conn, query: str, file_type: str = None, limit: int = 100, offset: int = 0):
-    """Full-text search across files."""
+def _update_sql(cols) -> str:
+    sets = ", ".join(f"{k} = ?" for k in cols if k != "filepath")
+    return f"UPDATE files SET {sets} WHERE filepath = ?"
+
+
+def upsert_file(conn, file_data: dict):
+    """Insert or update a file record and return its id."""
+    cols = list(file_data)
+    if _REQUIRED_COLUMNS.issubset(file_data):
+        return conn.execute(
+            _upsert_sql(cols) + " RETURNING id", [_db_value(v) for v in file_data.values()]
+        ).fetchone()[0]
+
+    # Partial rows (e.g. analysis results) only update existing records: SQLite
+    # checks NOT NULL before ON CONFLICT, so they can't go through the upsert
+    vals = [_db_value(v) for k, v in file_data.items() if k != "filepath"]
+    row = conn.execute(
+        _update_sql(cols) + " RETURNING id", vals + [file_data["filepath"]]
+    ).fetchone()
+    if row:
+        return row[0]
+    cur = conn.execute(
+        f"INSERT INTO files ({', '.join(cols)}) VALUES ({', '.join('?' * len(cols))})",
+        [_db_value(v) for v in file_data.values()]
+    )
+    return cur.lastrowid
+
+
+def upsert_files_bulk(conn, rows: list):
+    """
+    Insert or update many file records with one executemany per column set.
+    Runs inside the connection's current transaction; the caller commits.
+    """
+    groups = {}
+    for data in rows:
+        groups.setdefault(tuple(data), []).append(data)
+    for cols, group in groups.items():
+        if _REQUIRED_COLUMNS.issubset(cols):
+            conn.executemany(
+                _upsert_sql(cols), ([_db_value(d[k]) for k in cols] for d in group)
+            )
+        else:
+            conn.executemany(
+                _update_sql(cols),
+                ([_db_value(d[k]) for k in cols if k != "filepath"] + [d["filepath"]]
+                 for d in group)
+            )
+
+
+def search_files(conn, query: str, file_type: str = None, limit: int = 100, offset: int = 0,
+                 tag: str = None):
+    """Full-text search across files, optionally only those carrying `tag`."""
+    return iter_search_files(conn, query, file_type, limit, offset, tag).fetchall()
+
+
+def iter_search_files(conn, query: str, file_type: str = None, limit: int = 100, offset: int = 0,
+                      tag: str = None):
+    """Like search_files, but returns the cursor so rows can be consumed as they are read."""
     if query.strip():
         # Use FTS5 search
         sql = """
@@ -159,6 +306,11 @@ def search_files(conn, query: str, file_type: str = None, limit: int = 100, offs
         sql += " AND f.file_type = ?"
         params.append(file_type)
 
+    if tag:
+        # Exact tag match through the file_tags index, not a scan of the JSON
+        sql += " AND f.id IN (SELECT file_id FROM file_tags WHERE tag = ?)"
+        params.append(tag.strip().lower())
+
     if query.strip():
         sql += " ORDER BY rank"
     else:
@@ -167,13 +319,13 @@ def search_files(conn, query: str, file_type: str = None, limit: int = 100, offs
     sql += " LIMIT ? OFFSET ?"
     params.extend([limit, offset])
 
-    return conn.execute(sql, params).fetchall()
+    return conn.execute(sql, params)
 
 
 def get_duplicates(conn):
     """Get all files flagged as duplicates, grouped by their original."""
     rows = conn.execute("""
-        SELECT d.*, o.filepath as original_filepath, o.filename as original_filename
+        SELECT d.*, o.filepath as original_filepath, o.filename as original_name
         FROM files d
         LEFT JOIN files o ON d.duplicate_of = o.id
         WHERE d.is_duplicate = 1
@@ -191,17 +343,18 @@ def get_junk_files(conn):
 
 
 def get_stats(conn):
-    """Get summary statistics."""
-    stats = {}
-    stats["total_files"] = conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
-    stats["images"] = conn.execute("SELECT COUNT(*) FROM files WHERE file_type='image'").fetchone()[0]
-    stats["videos"] = conn.execute("SELECT COUNT(*) FROM files WHERE file_type='video'").fetchone()[0]
-    stats["analyzed"] = conn.execute("SELECT COUNT(*) FROM files WHERE ai_analyzed=1").fetchone()[0]
-    stats["duplicates"] = conn.execute("SELECT COUNT(*) FROM files WHERE is_duplicate=1").fetchone()[0]
-    stats["junk"] = conn.execute("SELECT COUNT(*) FROM files WHERE is_junk=1").fetchone()[0]
-    size_row = conn.execute("SELECT SUM(file_size) FROM files").fetchone()
-    stats["total_size"] = size_row[0] or 0
-    return stats
+    """Get summary statistics (one pass over the files table)."""
+    row = conn.execute("""
+        SELECT COUNT(*) AS total_files,
+               COALESCE(SUM(file_type = 'image'), 0) AS images,
+               COALESCE(SUM(file_type = 'video'), 0) AS videos,
+               COALESCE(SUM(ai_analyzed = 1), 0) AS analyzed,
+               COALESCE(SUM(is_duplicate = 1), 0) AS duplicates,
+               COALESCE(SUM(is_junk = 1), 0) AS junk,
+               COALESCE(SUM(file_size), 0) AS total_size
+        FROM files
+    """).fetchone()
+    return dict(row)
 
 
 def get_file_by_id(conn, file_id: int):
@@ -209,16 +362,43 @@ def get_file_by_id(conn, file_id: int):
     return conn.execute("SELECT * FROM files WHERE id = ?", (file_id,)).fetchone()
 
 
+def get_files_by_ids(conn, file_ids):
+    """Get the files with the given IDs in one query (unknown IDs are skipped)."""
+    file_ids = list(file_ids)
+    if not file_ids:
+        return []
+    marks = ",".join("?" * len(file_ids))
+    return conn.execute(f"SELECT * FROM files WHERE id IN ({marks})", file_ids).fetchall()
+
+
+def get_cached_analysis(conn, file_hash: str, model: str):
+    """Look up a cached analysis for the given file contents and model, or None."""
+    row = conn.execute(
+        "SELECT description, tags FROM vision_cache WHERE file_hash = ? AND model = ?",
+        (file_hash, model)
+    ).fetchone()
+    if not row:
+        return None
+    try:
+        tags = json.loads(row["tags"]) if row["tags"] else []
+    except (json.JSONDecodeError, TypeError):
+        tags = []
+    return {"description": row["description"], "tags": tags}
+
+
+def cache_analysis(conn, file_hash: str, model: str, description: str, tags: list):
+    """Store an analysis result for the given file contents and model."""
+    conn.execute(
+        "INSERT OR REPLACE INTO vision_cache (file_hash, model, description, tags) VALUES (?, ?, ?, ?)",
+        (file_hash, model, description, json.dumps(tags))
+    )
+
+
 def get_all_tags(conn):
     """Get all unique tags with counts."""
-    rows = conn.execute("SELECT tags FROM files WHERE tags IS NOT NULL AND tags != '[]'").fetchall()
-    tag_counts = {}
-    for row in rows:
-        try:
-            tags = json.loads(row["tags"])
-            for tag in tags:
-                tag = tag.strip().lower()
-                tag_counts[tag] = tag_counts.get(tag, 0) + 1
-        except (json.JSONDecodeError, TypeError):
-            pass
-    return sorted(tag_counts.items(), key=lambda x: -x[1])
+    rows = conn.execute("""
+        SELECT tag, COUNT(*) AS c FROM file_tags
+        GROUP BY tag
+        ORDER BY c DESC, tag
+    """).fetchall()
+    return [(row["tag"], row["c"]) for row in rows]
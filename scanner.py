@@ -2,42 +2,88 @@
 Core scanner: discovers files, extracts metadata, detects duplicates/junk.
 """
 import os
+import re
 import hashlib
 import json
 import logging
+import mmap
+import sqlite3
 import subprocess
 import tempfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
 from datetime import datetime
+from itertools import repeat
 from pathlib import Path
 
 from PIL import Image, ExifTags
-import imagehash
+import numpy as np
+import scipy.fftpack
 
 import config
 import database
 
+try:
+    from blake3 import blake3 as _blake3
+except ImportError:  # optional; SHA-256 is used instead
+    _blake3 = None
+
+try:
+    import av as _av
+except ImportError:  # optional; videos are probed with ffprobe instead
+    _av = None
+
 logger = logging.getLogger(__name__)
 
+_MEDIA_EXTENSIONS = frozenset(config.IMAGE_EXTENSIONS | config.VIDEO_EXTENSIONS)
+
+# Thumbnail/system file names ("thumb" also covers "thumbnail" and "thumbs.db")
+_JUNK_NAME_RE = re.compile(r"thumb|\.ds_store|desktop\.ini")
+
+# Vendor-specific binary EXIF blob; large on phone photos and useless as text
+_MAKER_NOTE_TAG = 0x927C
+
+# Side of the grayscale thumbnail the perceptual hash is computed from
+_PHASH_SIZE = 32
+
+# Read size when hashing file contents without hashlib.file_digest
+_HASH_CHUNK_SIZE = 1 << 20
+
+# Files at least this large are hashed through mmap instead of read() calls
+_MMAP_HASH_THRESHOLD = 64 << 20
+_MMAP_HASH_SLICE = 16 << 20
+
 
 def discover_files(scan_dir: str):
     """Walk directory and yield media file paths."""
-    scan_dir = os.path.expanduser(scan_dir)
-    all_extensions = config.IMAGE_EXTENSIONS | config.VIDEO_EXTENSIONS
-
-    for root, dirs, files in os.walk(scan_dir):
-        # Skip hidden directories
-        dirs[:] = [d for d in dirs if not d.startswith(".")]
-        for fname in files:
-            if fname.startswith("."):
-                continue
-            ext = os.path.splitext(fname)[1].lower()
-            if ext in all_extensions:
-                yield os.path.join(root, fname)
+    stack = [os.path.expanduser(scan_dir)]
+    while stack:
+        try:
+            entries = os.scandir(stack.pop())
+        except OSError:
+            continue  # unreadable directory, skipped like os.walk does
+        # Entry types come from the directory listing (d_type), so only
+        # symlinks cost a stat; the extension test runs before any of it
+        with entries:
+            for entry in entries:
+                if entry.name.startswith("."):
+                    continue
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif os.path.splitext(entry.name)[1].lower() in _MEDIA_EXTENSIONS and entry.is_file():
+                        yield entry.path
+                except OSError:
+                    continue
 
 
 def get_file_type(filepath: str) -> str:
     """Determine if file is image or video."""
-    ext = os.path.splitext(filepath)[1].lower()
+    return _type_for_ext(os.path.splitext(filepath)[1].lower())
+
+
+def _type_for_ext(ext: str) -> str:
     if ext in config.IMAGE_EXTENSIONS:
         return "image"
     elif ext in config.VIDEO_EXTENSIONS:
@@ -45,38 +91,90 @@ def get_file_type(filepath: str) -> str:
     return "unknown"
 
 
+def _hash_mapped(f):
+    """Hash a large open file through a read-only memory map, in 16 MiB slices."""
+    hasher = _blake3() if _blake3 else hashlib.sha256()
+    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        if hasattr(mmap, "MADV_SEQUENTIAL"):
+            # Let the kernel read ahead aggressively and drop pages behind us
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        view = memoryview(mm)
+        try:
+            for offset in range(0, len(mm), _MMAP_HASH_SLICE):
+                hasher.update(view[offset:offset + _MMAP_HASH_SLICE])
+        finally:
+            # The map can't close while a view still exports its buffer
+            view.release()
+    return hasher
+
+
 def compute_file_hash(filepath: str) -> str:
-    """Compute SHA-256 hash of file contents."""
-    sha = hashlib.sha256()
-    with open(filepath, "rb") as f:
-        while True:
-            chunk = f.read(8192)
-            if not chunk:
-                break
-            sha.update(chunk)
-    return sha.hexdigest()
-
-
-def compute_perceptual_hash(filepath: str) -> str | None:
-    """Compute perceptual hash for an image (for near-duplicate detection)."""
+    """
+    Hash file contents for exact-duplicate detection. Uses BLAKE3 when the
+    optional blake3 package is installed, prefixed "blake3:" so it is never
+    confused with the plain SHA-256 hex stored otherwise (and by older scans).
+    """
+    with open(filepath, "rb", buffering=0) as f:
+        if os.fstat(f.fileno()).st_size >= _MMAP_HASH_THRESHOLD:
+            hasher = _hash_mapped(f)
+        elif hasattr(hashlib, "file_digest"):
+            hasher = hashlib.file_digest(f, _blake3 or "sha256")
+        else:
+            # Python < 3.11: reuse one buffer instead of a new bytes object per chunk
+            hasher = _blake3() if _blake3 else hashlib.sha256()
+            buf = bytearray(_HASH_CHUNK_SIZE)
+            view = memoryview(buf)
+            while n := f.readinto(buf):
+                hasher.update(view[:n])
+    return f"blake3:{hasher.hexdigest()}" if _blake3 else hasher.hexdigest()
+
+
+@contextmanager
+def _opened(source):
+    """Yield a PIL image for a path, or an already-open image unchanged."""
+    if isinstance(source, Image.Image):
+        yield source
+    else:
+        with Image.open(source) as img:
+            yield img
+
+
+def compute_perceptual_hash(source) -> str | None:
+    """
+    Compute perceptual hash for an image path or open PIL image (for
+    near-duplicate detection). Same DCT hash and hex format as imagehash.phash,
+    but JPEGs are decoded straight at reduced scale since only a 32x32
+    thumbnail is needed. This loads the image, so use it last on an open one.
+    """
     try:
-        img = Image.open(filepath)
-        phash = imagehash.phash(img)
-        return str(phash)
+        with _opened(source) as img:
+            img.draft("L", (_PHASH_SIZE, _PHASH_SIZE))
+            small = img.convert("L").resize((_PHASH_SIZE, _PHASH_SIZE), Image.LANCZOS)
+        pixels = np.asarray(small, dtype=np.float64)
+        dct = scipy.fftpack.dct(scipy.fftpack.dct(pixels, axis=0), axis=1)
+        low = dct[:8, :8]
+        return np.packbits(low > np.median(low)).tobytes().hex()
     except (OSError, Image.UnidentifiedImageError, ValueError) as e:
-        logger.warning("Perceptual hash failed for %s: %s", filepath, e)
+        logger.warning("Perceptual hash failed for %s: %s", getattr(source, "filename", source), e)
         return None
 
 
-def extract_exif(filepath: str) -> dict:
-    """Extract EXIF metadata from an image."""
+def extract_exif(source) -> dict:
+    """Extract EXIF metadata from an image path or open PIL image."""
     try:
-        img = Image.open(filepath)
-        exif_raw = img._getexif()
-        if not exif_raw:
-            return {}
+        with _opened(source) as img:
+            # getexif() parses IFDs lazily: only the base and Exif IFDs are
+            # read here, and the MakerNote blob is never decoded
+            exif_raw = img.getexif()
+            entries = dict(exif_raw)
+            if ExifTags.IFD.Exif in exif_raw:
+                entries.update(exif_raw.get_ifd(ExifTags.IFD.Exif))
+            if ExifTags.IFD.GPSInfo in exif_raw:
+                entries[ExifTags.IFD.GPSInfo] = exif_raw.get_ifd(ExifTags.IFD.GPSInfo)
         exif = {}
-        for tag_id, value in exif_raw.items():
+        for tag_id, value in entries.items():
+            if tag_id == _MAKER_NOTE_TAG:
+                continue
             tag_name = ExifTags.TAGS.get(tag_id, str(tag_id))
             # Convert bytes and other non-serializable types
             if isinstance(value, bytes):
@@ -91,77 +189,121 @@ def extract_exif(filepath: str) -> dict:
             exif[tag_name] = value
         return exif
     except (OSError, Image.UnidentifiedImageError, AttributeError) as e:
-        logger.warning("EXIF extraction failed for %s: %s", filepath, e)
+        logger.warning("EXIF extraction failed for %s: %s", getattr(source, "filename", source), e)
         return {}
 
 
-def extract_image_metadata(filepath: str) -> dict:
-    """Extract full metadata from an image file."""
-    stat = os.stat(filepath)
-    data = {
+_HASH_POOL = None
+_HASH_POOL_PID = None
+
+
+def _hash_pool() -> ThreadPoolExecutor:
+    """Per-process helper threads for file hashing (recreated after a fork)."""
+    global _HASH_POOL, _HASH_POOL_PID
+    if _HASH_POOL is None or _HASH_POOL_PID != os.getpid():
+        _HASH_POOL = ThreadPoolExecutor(max_workers=2, thread_name_prefix="file-hash")
+        _HASH_POOL_PID = os.getpid()
+    return _HASH_POOL
+
+
+def modified_date(stat: os.stat_result) -> str:
+    """The modified_date column value for a file's stat() result."""
+    return datetime.fromtimestamp(stat.st_mtime).isoformat()
+
+
+def _base_metadata(filepath: str, file_type: str, stat: os.stat_result, scan_date: str = None) -> dict:
+    """Columns shared by images and videos, derived from one stat() result."""
+    filename = os.path.basename(filepath)
+    return {
         "filepath": filepath,
-        "filename": os.path.basename(filepath),
-        "original_filename": os.path.basename(filepath),
-        "file_type": "image",
+        "filename": filename,
+        "original_filename": filename,
+        "file_type": file_type,
         "file_size": stat.st_size,
         "created_date": datetime.fromtimestamp(stat.st_birthtime if hasattr(stat, "st_birthtime") else stat.st_ctime).isoformat(),
-        "modified_date": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-        "scan_date": datetime.now().isoformat(),
+        "modified_date": modified_date(stat),
+        "scan_date": scan_date or datetime.now().isoformat(),
     }
 
-    # Image dimensions
+
+def extract_image_metadata(filepath: str, stat: os.stat_result = None, hash_file: bool = True,
+                           scan_date: str = None) -> dict:
+    """
+    Extract full metadata from an image file (pass `stat` if already known).
+    With hash_file=False the content hash is left empty.
+    """
+    data = _base_metadata(filepath, "image", stat or os.stat(filepath), scan_date)
+
+    # Hash the raw bytes on a helper thread while this one decodes the image;
+    # hashlib and Pillow both release the GIL
+    file_hash = _hash_pool().submit(compute_file_hash, filepath) if hash_file else None
+
+    # Dimensions, EXIF and perceptual hash all come from a single open
+    exif = {}
+    data["perceptual_hash"] = None
     try:
         with Image.open(filepath) as img:
             data["width"], data["height"] = img.size
+            exif = extract_exif(img)
+            data["perceptual_hash"] = compute_perceptual_hash(img)
     except (OSError, Image.UnidentifiedImageError) as e:
         logger.warning("Could not read image dimensions for %s: %s", filepath, e)
 
-    # EXIF
-    exif = extract_exif(filepath)
     if exif:
-        data["exif_data"] = json.dumps(exif)
+        # Compact, unescaped JSON: less to encode and to store per row
+        data["exif_data"] = json.dumps(exif, separators=(",", ":"), ensure_ascii=False)
 
-    # Hashes
-    data["file_hash"] = compute_file_hash(filepath)
-    data["perceptual_hash"] = compute_perceptual_hash(filepath)
+    data["file_hash"] = file_hash.result() if file_hash else None
 
     return data
 
 
-def extract_video_metadata(filepath: str) -> dict:
-    """Extract metadata from a video file."""
-    stat = os.stat(filepath)
-    data = {
-        "filepath": filepath,
-        "filename": os.path.basename(filepath),
-        "original_filename": os.path.basename(filepath),
-        "file_type": "video",
-        "file_size": stat.st_size,
-        "created_date": datetime.fromtimestamp(stat.st_birthtime if hasattr(stat, "st_birthtime") else stat.st_ctime).isoformat(),
-        "modified_date": datetime.fromtimestamp(stat.st_mtime).isoformat(),
-        "scan_date": datetime.now().isoformat(),
-    }
-
-    # Try to get video dimensions with ffprobe
+def _probe_dimensions(filepath: str):
+    """
+    (width, height) of the first video stream, or None. Probed in-process
+    with PyAV when installed, otherwise (or if PyAV can't read the file)
+    with ffprobe.
+    """
+    if _av is not None:
+        try:
+            with _av.open(filepath) as container:
+                stream = container.streams.video[0]
+                return stream.width, stream.height
+        except (_av.error.FFmpegError, OSError, IndexError) as e:
+            logger.debug("PyAV could not probe %s, trying ffprobe: %s", filepath, e)
+
+    # Only the first video stream's dimensions are requested, so ffprobe
+    # skips describing every stream and the JSON stays tiny
     try:
         result = subprocess.run(
             ["ffprobe", "-v", "quiet", "-print_format", "json",
-             "-show_streams", filepath],
+             "-select_streams", "v:0", "-show_entries", "stream=width,height", filepath],
             capture_output=True, text=True, timeout=30
         )
         if result.returncode == 0:
-            info = json.loads(result.stdout)
-            for stream in info.get("streams", []):
-                if stream.get("codec_type") == "video":
-                    data["width"] = int(stream.get("width", 0))
-                    data["height"] = int(stream.get("height", 0))
-                    break
+            streams = json.loads(result.stdout).get("streams", [])
+            if streams:
+                return int(streams[0].get("width", 0)), int(streams[0].get("height", 0))
     except (subprocess.TimeoutExpired, subprocess.SubprocessError, json.JSONDecodeError, ValueError) as e:
         logger.warning("ffprobe failed for %s: %s", filepath, e)
     except FileNotFoundError:
         logger.warning("ffprobe not found — install ffmpeg to extract video metadata")
+    return None
+
 
-    data["file_hash"] = compute_file_hash(filepath)
+def extract_video_metadata(filepath: str, stat: os.stat_result = None, hash_file: bool = True,
+                           scan_date: str = None) -> dict:
+    """
+    Extract metadata from a video file (pass `stat` if already known).
+    With hash_file=False the content hash is left empty.
+    """
+    data = _base_metadata(filepath, "video", stat or os.stat(filepath), scan_date)
+
+    dimensions = _probe_dimensions(filepath)
+    if dimensions:
+        data["width"], data["height"] = dimensions
+
+    data["file_hash"] = compute_file_hash(filepath) if hash_file else None
     return data
 
 
@@ -181,21 +323,27 @@ def extract_video_frames(filepath: str, num_frames: int = 3) -> list[str]:
         except (ValueError, AttributeError):
             duration = 10.0
 
+        # One ffmpeg process for all frames: each timestamp is a separately
+        # seeked input of the same file, mapped to its own single-frame output
+        cmd = ["ffmpeg", "-v", "error", "-y"]
+        outputs = []
         for i in range(num_frames):
             timestamp = duration * (i + 1) / (num_frames + 1)
+            cmd += ["-ss", f"{timestamp:.3f}", "-i", filepath]
+        for i in range(num_frames):
             tmp = tempfile.NamedTemporaryFile(suffix=".jpg", delete=False)
             tmp.close()
             created_temps.append(tmp.name)
-            subprocess.run(
-                ["ffmpeg", "-ss", str(timestamp), "-i", filepath,
-                 "-vframes", "1", "-y", "-q:v", "2", tmp.name],
-                capture_output=True, timeout=30
-            )
-            if os.path.getsize(tmp.name) > 0:
-                frames.append(tmp.name)
+            outputs.append(tmp.name)
+            cmd += ["-map", f"{i}:v:0", "-frames:v", "1", "-q:v", "2", tmp.name]
+        subprocess.run(cmd, capture_output=True, timeout=30 + 10 * num_frames)
+
+        for out in outputs:
+            if os.path.getsize(out) > 0:
+                frames.append(out)
             else:
-                os.unlink(tmp.name)
-                created_temps.remove(tmp.name)
+                os.unlink(out)
+                created_temps.remove(out)
     except (subprocess.TimeoutExpired, subprocess.SubprocessError, OSError) as e:
         logger.warning("Video frame extraction failed for %s: %s", filepath, e)
         # Clean up any temp files that weren't added to frames
@@ -210,8 +358,12 @@ def extract_video_frames(filepath: str, num_frames: int = 3) -> list[str]:
     return frames
 
 
-def detect_junk(filepath: str, file_size: int) -> tuple[bool, str]:
-    """Check if a file looks like junk."""
+def detect_junk(filepath: str, file_size: int, ext: str = None, decode_ok: bool = False) -> tuple[bool, str]:
+    """
+    Check if a file looks like junk. `ext` is the lowercased extension, if
+    known. Pass decode_ok=True when the image was already decoded
+    successfully, which makes re-reading it with verify() unnecessary.
+    """
     reasons = []
     fname = os.path.basename(filepath).lower()
 
@@ -220,13 +372,13 @@ def detect_junk(filepath: str, file_size: int) -> tuple[bool, str]:
         reasons.append(f"very small ({file_size} bytes)")
 
     # Common junk patterns
-    junk_patterns = ["thumb", "thumbnail", ".ds_store", "desktop.ini", "thumbs.db"]
-    if any(p in fname for p in junk_patterns):
+    if _JUNK_NAME_RE.search(fname):
         reasons.append("thumbnail/system file pattern")
 
     # Corrupted images
-    ext = os.path.splitext(filepath)[1].lower()
-    if ext in config.IMAGE_EXTENSIONS:
+    if ext is None:
+        ext = os.path.splitext(filepath)[1].lower()
+    if ext in config.IMAGE_EXTENSIONS and not decode_ok:
         try:
             with Image.open(filepath) as img:
                 img.verify()
@@ -238,25 +390,97 @@ def detect_junk(filepath: str, file_size: int) -> tuple[bool, str]:
     return False, ""
 
 
+# Max Hamming distance between perceptual hashes of "near duplicate" images
+PHASH_DUPLICATE_DISTANCE = 8
+
+# All 16-bit masks with at most two bits set. A 64-bit phash is split into four
+# 16-bit chunks; two hashes within distance 8 differ in at most 2 bits of some
+# chunk (pigeonhole), so probing each chunk's bucket under these masks finds
+# every near-duplicate without comparing all pairs.
+_CHUNK_PROBES = [0] + [1 << a for a in range(16)] + [
+    (1 << a) | (1 << b) for a in range(16) for b in range(a + 1, 16)
+]
+
+
+def _popcount64_swar(x):
+    """Per-element bit count of a uint64 numpy array (SWAR, fully vectorized)."""
+    x = x - ((x >> np.uint64(1)) & np.uint64(0x5555555555555555))
+    x = (x & np.uint64(0x3333333333333333)) + ((x >> np.uint64(2)) & np.uint64(0x3333333333333333))
+    x = (x + (x >> np.uint64(4))) & np.uint64(0x0F0F0F0F0F0F0F0F)
+    return (x * np.uint64(0x0101010101010101)) >> np.uint64(56)
+
+
+# NumPy 2.0+ has a native popcount ufunc (POPCNT where the CPU supports it)
+_popcount64 = getattr(np, "bitwise_count", _popcount64_swar)
+
+
+def _near_duplicate_pairs(hashes: list) -> list:
+    """
+    Return (dup_index, original_index) for every hash that lies within
+    PHASH_DUPLICATE_DISTANCE of an earlier one, pairing it with the earliest.
+    """
+    values = np.array(hashes, dtype=np.uint64)
+    tables = [{} for _ in range(4)]
+    first_seen = {}  # hash value -> index of its first occurrence
+    earliest = {}    # first occurrence -> index of its earliest near match
+    pairs = []
+    for j, h in enumerate(hashes):
+        # Repeats of a hash (blank or black frames, bursts) share the first
+        # occurrence's match and never enter the buckets, which would
+        # otherwise make every later probe return all of them
+        first = first_seen.get(h)
+        if first is not None:
+            pairs.append((j, earliest.get(first, first)))
+            continue
+        first_seen[h] = j
+
+        chunks = [(h >> (16 * k)) & 0xFFFF for k in range(4)]
+        candidates = set()
+        for table, chunk in zip(tables, chunks):
+            for mask in _CHUNK_PROBES:
+                candidates.update(table.get(chunk ^ mask, ()))
+        if candidates:
+            # Check this hash's candidates in one vectorized pass
+            cand = np.fromiter(candidates, dtype=np.intp, count=len(candidates))
+            close = cand[_popcount64(values[cand] ^ values[j]) <= PHASH_DUPLICATE_DISTANCE]
+            if close.size:
+                earliest[j] = int(close.min())
+                pairs.append((j, earliest[j]))
+        for table, chunk in zip(tables, chunks):
+            table.setdefault(chunk, []).append(j)
+    return pairs
+
+
 def find_duplicates(conn):
     """Detect duplicate files using file hash and perceptual hash."""
-    # Exact duplicates (same file hash)
+    # Take the write lock up front and mark everything in one transaction
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+
+    # Exact duplicates (same file hash): one row per file in a shared-hash group
     rows = conn.execute("""
-        SELECT file_hash, GROUP_CONCAT(id) as ids
-        FROM files
-        WHERE file_hash IS NOT NULL
-        GROUP BY file_hash
-        HAVING COUNT(*) > 1
+        SELECT file_hash, id FROM files
+        WHERE file_hash IN (
+            SELECT file_hash FROM files
+            WHERE file_hash IS NOT NULL
+            GROUP BY file_hash
+            HAVING COUNT(*) > 1
+        )
+        ORDER BY file_hash, id
     """).fetchall()
 
+    updates = []
+    original_id = current_hash = None
     for row in rows:
-        ids = [int(x) for x in row["ids"].split(",")]
-        original_id = ids[0]  # Keep the first one as "original"
-        for dup_id in ids[1:]:
-            conn.execute("""
-                UPDATE files SET is_duplicate = 1, duplicate_of = ?
-                WHERE id = ?
-            """, (original_id, dup_id))
+        if row["file_hash"] != current_hash:
+            # Keep the first one as "original"
+            current_hash, original_id = row["file_hash"], row["id"]
+        else:
+            updates.append((original_id, row["id"]))
+    conn.executemany("""
+        UPDATE files SET is_duplicate = 1, duplicate_of = ?
+        WHERE id = ?
+    """, updates)
 
     # Near-duplicates for images (perceptual hash)
     phash_rows = conn.execute("""
@@ -264,24 +488,102 @@ def find_duplicates(conn):
         WHERE perceptual_hash IS NOT NULL
         AND is_duplicate = 0
         AND file_type = 'image'
+        ORDER BY id
     """).fetchall()
 
-    # Compare perceptual hashes (hamming distance)
-    phash_list = [(r["id"], imagehash.hex_to_hash(r["perceptual_hash"])) for r in phash_rows]
-    for i, (id_a, hash_a) in enumerate(phash_list):
-        for j, (id_b, hash_b) in enumerate(phash_list):
-            if j <= i:
-                continue
-            distance = hash_a - hash_b
-            if distance <= 8:  # Threshold for "near duplicate"
-                conn.execute("""
-                    UPDATE files SET is_duplicate = 1, duplicate_of = ?
-                    WHERE id = ? AND is_duplicate = 0
-                """, (id_a, id_b))
+    ids = [r["id"] for r in phash_rows]
+    hashes = [int(r["perceptual_hash"], 16) for r in phash_rows]
+    pairs = [(ids[orig], ids[dup]) for dup, orig in _near_duplicate_pairs(hashes)]
+    conn.executemany("""
+        UPDATE files SET is_duplicate = 1, duplicate_of = ?
+        WHERE id = ? AND is_duplicate = 0
+    """, pairs)
 
     conn.commit()
 
 
+def _process_file(filepath: str, stat: os.stat_result = None, hash_file: bool = True,
+                  scan_date: str = None):
+    """
+    Extract metadata and junk flags for one file; runs in a worker process.
+    Returns (data, error): data is None for unsupported files.
+    """
+    try:
+        # Derive the extension and stat the file once, for every step below
+        ext = os.path.splitext(filepath)[1].lower()
+        ftype = _type_for_ext(ext)
+        if ftype == "image":
+            data = extract_image_metadata(filepath, stat or os.stat(filepath), hash_file, scan_date)
+        elif ftype == "video":
+            data = extract_video_metadata(filepath, stat or os.stat(filepath), hash_file, scan_date)
+        else:
+            return None, None
+
+        # Check for junk; the perceptual hash is only set if the whole
+        # image decoded, so a corruption check is needed only without it
+        decode_ok = ftype == "image" and data.get("perceptual_hash") is not None
+        is_junk, junk_reason = detect_junk(filepath, data.get("file_size", 0), ext, decode_ok)
+        data["is_junk"] = 1 if is_junk else 0
+        data["junk_reason"] = junk_reason if is_junk else None
+        return data, None
+    except Exception as e:
+        return None, str(e)
+
+
+def _stat_or_none(filepath: str):
+    """os.stat, or None if the file vanished or is unreadable."""
+    try:
+        return os.stat(filepath)
+    except OSError:
+        return None
+
+
+def _hash_shared_sizes(conn):
+    """Hash unhashed files whose size is shared with another file in the database."""
+    rows = conn.execute("""
+        SELECT id, filepath FROM files
+        WHERE file_hash IS NULL AND file_size IN (
+            SELECT file_size FROM files
+            GROUP BY file_size
+            HAVING COUNT(*) > 1
+        )
+    """).fetchall()
+
+    updates = []
+    for row in rows:
+        try:
+            updates.append((compute_file_hash(row["filepath"]), row["id"]))
+        except OSError as e:
+            logger.warning("Could not hash %s: %s", row["filepath"], e)
+    conn.executemany("UPDATE files SET file_hash = ? WHERE id = ?", updates)
+    conn.commit()
+
+
+def _flush_batch(conn, batch: list, errors: list) -> int:
+    """
+    Write buffered file records in one executemany and commit. If the batch
+    fails, rows are retried one by one so a single bad record only loses
+    itself. Returns the number of records that could not be written.
+    """
+    if not batch:
+        return 0
+    failed = 0
+    try:
+        database.upsert_files_bulk(conn, batch)
+    except sqlite3.Error:
+        conn.rollback()
+        for data in batch:
+            try:
+                database.upsert_file(conn, data)
+            except sqlite3.Error as e:
+                logger.warning("Failed to store %s: %s", data["filepath"], e)
+                errors.append(f"{data['filepath']}: {str(e)}")
+                failed += 1
+    conn.commit()
+    batch.clear()
+    return failed
+
+
 def scan_directory(scan_dir: str = None, progress_callback=None):
     """
     Main scan function: discover files, extract metadata, detect junk/duplicates.
@@ -289,46 +591,50 @@ def scan_directory(scan_dir: str = None, progress_callback=None):
     """
     scan_dir = scan_dir or config.SCAN_DIR
     conn = database.init_db()
+    # A larger page cache (64 MiB) for the bulk upserts of this connection
+    conn.execute("PRAGMA cache_size=-65536")
 
     files_found = 0
     files_processed = 0
     errors = []
 
+    # Every file found by one scan shares a single scan timestamp
+    scan_date = datetime.now().isoformat()
     all_files = list(discover_files(scan_dir))
     total = len(all_files)
-
-    for i, filepath in enumerate(all_files):
-        try:
+    batch = []
+
+    # Byte-identical files must have the same size, so only files sharing
+    # a size with another file in this scan are hashed up front
+    stats = [_stat_or_none(p) for p in all_files]
+    sizes = Counter(st.st_size for st in stats if st)
+    hash_needed = [bool(st) and sizes[st.st_size] > 1 for st in stats]
+
+    # Metadata extraction (hashing, phash DCT, ffprobe) runs in worker
+    # processes; only the main process touches the database
+    with ProcessPoolExecutor(max_workers=config.SCAN_WORKERS or os.cpu_count()) as pool:
+        results = pool.map(_process_file, all_files, stats, hash_needed, repeat(scan_date),
+                           chunksize=32)
+        for i, (filepath, (data, error)) in enumerate(zip(all_files, results)):
             files_found += 1
-            ftype = get_file_type(filepath)
+            if error:
+                logger.warning("Failed to process %s: %s", filepath, error)
+                errors.append(f"{filepath}: {error}")
+            elif data:
+                batch.append(data)
+                files_processed += 1
 
-            if ftype == "image":
-                data = extract_image_metadata(filepath)
-            elif ftype == "video":
-                data = extract_video_metadata(filepath)
-            else:
-                continue
-
-            # Check for junk
-            is_junk, junk_reason = detect_junk(filepath, data.get("file_size", 0))
-            data["is_junk"] = 1 if is_junk else 0
-            data["junk_reason"] = junk_reason if is_junk else None
-
-            database.upsert_file(conn, data)
-            files_processed += 1
+                if progress_callback and (i + 1) % 10 == 0:
+                    progress_callback(i + 1, total)
 
-            if progress_callback and (i + 1) % 10 == 0:
-                progress_callback(i + 1, total)
+            # Write and commit in batches
+            if len(batch) >= config.BATCH_SIZE:
+                files_processed -= _flush_batch(conn, batch, errors)
 
-        except Exception as e:
-            logger.warning("Failed to process %s: %s", filepath, e)
-            errors.append(f"{filepath}: {str(e)}")
+    files_processed -= _flush_batch(conn, batch, errors)
 
-        # Commit in batches
-        if (i + 1) % config.BATCH_SIZE == 0:
-            conn.commit()
-
-    conn.commit()
+    # Files from earlier scans may share a size with files found now
+    _hash_shared_sizes(conn)
 
     # Detect duplicates
     if progress_callback:
@@ -1,6 +1,7 @@
 """Shared fixtures for photo-tagger tests."""
 import json
 import os
+import shutil
 import sys
 
 import pytest
@@ -12,6 +13,24 @@ sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 import database
 
 
+def pytest_addoption(parser):
+    parser.addoption("--runslow", action="store_true", default=False,
+                     help="also run tests marked slow")
+
+
+def pytest_configure(config):
+    config.addinivalue_line("markers", "slow: expensive test, skipped unless --runslow is given")
+
+
+def pytest_collection_modifyitems(config, items):
+    if config.getoption("--runslow"):
+        return
+    skip_slow = pytest.mark.skip(reason="slow test, use --runslow to run")
+    for item in items:
+        if "slow" in item.keywords:
+            item.add_marker(skip_slow)
+
+
 @pytest.fixture
 def db_conn():
     """In-memory SQLite connection with schema initialized."""
@@ -21,20 +40,47 @@ def db_conn():
 
 
 @pytest.fixture
-def sample_image(tmp_path):
-    """Create a small 100x100 RGB JPEG in tmp_path."""
+def make_sparse():
+    """Factory creating a zero-filled file of `size` bytes without writing any data."""
+    def make(path, size):
+        with open(path, "wb"):
+            pass
+        os.truncate(path, size)
+        return path
+    return make
+
+
+@pytest.fixture(scope="session")
+def _encoded_images(tmp_path_factory):
+    """Encode the sample images once per test session."""
+    root = tmp_path_factory.mktemp("images")
+    jpeg, png = root / "test_photo.jpg", root / "test_rgba.png"
+    Image.new("RGB", (100, 100), color=(200, 100, 50)).save(str(jpeg), format="JPEG")
+    Image.new("RGBA", (80, 80), color=(200, 100, 50, 128)).save(str(png), format="PNG")
+    return {"jpeg": jpeg, "png": png}
+
+
+@pytest.fixture
+def sample_image(tmp_path, _encoded_images):
+    """A small 100x100 RGB JPEG in tmp_path (a fresh copy; tests may move it)."""
     path = tmp_path / "test_photo.jpg"
-    img = Image.new("RGB", (100, 100), color=(200, 100, 50))
-    img.save(str(path), format="JPEG")
+    shutil.copyfile(_encoded_images["jpeg"], path)
     return str(path)
 
 
 @pytest.fixture
-def sample_rgba_image(tmp_path):
-    """Create a small RGBA PNG for conversion tests."""
+def sample_rgba_image(tmp_path, _encoded_images):
+    """A small RGBA PNG for conversion tests, copied into tmp_path."""
     path = tmp_path / "test_rgba.png"
-    img = Image.new("RGBA", (80, 80), color=(200, 100, 50, 128))
-    img.save(str(path), format="PNG")
+    shutil.copyfile(_encoded_images["png"], path)
+    return str(path)
+
+
+@pytest.fixture(scope="session")
+def tiny_rgba_image(tmp_path_factory):
+    """A 1x1 RGBA PNG without EXIF, shared read-only by the whole session."""
+    path = tmp_path_factory.mktemp("tiny") / "tiny.png"
+    Image.new("RGBA", (1, 1)).save(str(path), format="PNG")
     return str(path)
 
 
@@ -1,15 +1,37 @@
 """Tests for ai_analyzer.py."""
 import base64
+import gzip
+import io
 import json
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from unittest.mock import patch, MagicMock
 
 import pytest
 import requests
-from PIL import Image
+from PIL import Image, JpegImagePlugin
 
 import ai_analyzer
 import database
+import scanner
+
+
+@pytest.fixture(autouse=True)
+def _fresh_refine_cache():
+    """Start every test with an empty refine cache so results never depend on test order."""
+    ai_analyzer._refine_cached.cache_clear()
+
+
+def _stream_response(text, size=8):
+    """Fake a streamed Ollama generate response delivering `text` in small chunks."""
+    lines = [json.dumps({"response": text[i:i + size], "done": False}).encode()
+             for i in range(0, len(text), size)]
+    lines.append(json.dumps({"response": "", "done": True}).encode())
+    resp = MagicMock()
+    resp.iter_lines.side_effect = lambda: iter(lines)
+    return resp
 
 
 # ── parse_ai_response ────────────────────────────────────────────────────────
@@ -61,6 +83,14 @@ def test_image_to_base64_rgba_conversion(sample_rgba_image):
     assert decoded[:2] == b"\xff\xd8"
 
 
+def test_image_to_base64_la_conversion(tmp_path):
+    path = tmp_path / "gray_alpha.png"
+    Image.new("LA", (40, 30), (128, 200)).save(str(path), format="PNG")
+    img = Image.open(io.BytesIO(base64.b64decode(ai_analyzer.image_to_base64(str(path)))))
+    assert img.format == "JPEG"
+    assert img.mode == "RGB"
+
+
 def test_image_to_base64_resize(tmp_path):
     big_path = tmp_path / "big.jpg"
     img = Image.new("RGB", (3000, 2000), color=(100, 150, 200))
@@ -68,10 +98,33 @@ def test_image_to_base64_resize(tmp_path):
 
     b64 = ai_analyzer.image_to_base64(str(big_path), max_dim=512)
     decoded = base64.b64decode(b64)
-    resized = Image.open(__import__("io").BytesIO(decoded))
+    resized = Image.open(io.BytesIO(decoded))
     assert max(resized.size) <= 512
 
 
+def test_image_to_base64_draft_keeps_target_size(tmp_path):
+    big_path = tmp_path / "big.jpg"
+    Image.new("RGB", (2000, 1500), color=(10, 20, 30)).save(str(big_path), format="JPEG")
+
+    jpeg_draft = JpegImagePlugin.JpegImageFile.draft
+    with patch.object(JpegImagePlugin.JpegImageFile, "draft", autospec=True,
+                      side_effect=jpeg_draft) as draft:
+        b64 = ai_analyzer.image_to_base64(str(big_path), max_dim=500)
+
+    img = draft.call_args.args[0]
+    draft.assert_called_once_with(img, "RGB", (500, 500))
+    # libjpeg decoded at 1/2 scale instead of full resolution
+    assert img.size == (1000, 750)
+    resized = Image.open(io.BytesIO(base64.b64decode(b64)))
+    assert resized.size == (500, 375)
+
+
+def test_encode_payload_splices_images():
+    body = ai_analyzer._encode_payload({"model": "m", "prompt": 'say "hi"', "images": [b"QUJD", "REVG"]})
+    assert isinstance(body, bytes)
+    assert json.loads(body) == {"model": "m", "prompt": 'say "hi"', "images": ["QUJD", "REVG"]}
+
+
 def test_image_to_base64_missing_file():
     with pytest.raises(FileNotFoundError):
         ai_analyzer.image_to_base64("/nonexistent/photo.jpg")
@@ -81,14 +134,9 @@ def test_image_to_base64_missing_file():
 
 
 def test_analyze_with_vision_success():
-    mock_resp = MagicMock()
-    mock_resp.status_code = 200
-    mock_resp.json.return_value = {
-        "response": '{"description": "A dog on a beach", "tags": ["dog", "beach"]}'
-    }
-    mock_resp.raise_for_status = MagicMock()
+    mock_resp = _stream_response('{"description": "A dog on a beach", "tags": ["dog", "beach"]}')
 
-    with patch("ai_analyzer.requests.post", return_value=mock_resp):
+    with patch("ai_analyzer._SESSION.post", return_value=mock_resp):
         result = ai_analyzer.analyze_with_vision("fakebase64")
 
     assert result["description"] == "A dog on a beach"
@@ -96,11 +144,90 @@ def test_analyze_with_vision_success():
 
 
 def test_analyze_with_vision_connection_error():
-    with patch("ai_analyzer.requests.post", side_effect=requests.exceptions.ConnectionError):
+    with patch("ai_analyzer._SESSION.post", side_effect=requests.exceptions.ConnectionError) as post, \
+         patch("ai_analyzer.time.sleep"):
         result = ai_analyzer.analyze_with_vision("fakebase64")
 
     assert "Cannot connect" in result["description"]
     assert result["tags"] == []
+    assert result["error"] == ai_analyzer.OLLAMA_UNREACHABLE
+    assert post.call_count == ai_analyzer.config.OLLAMA_MAX_RETRIES + 1
+
+
+def test_analyze_with_vision_retries_then_succeeds():
+    mock_resp = _stream_response('{"description": "ok", "tags": []}')
+
+    with patch("ai_analyzer._SESSION.post",
+               side_effect=[requests.exceptions.ConnectionError, mock_resp]), \
+         patch("ai_analyzer.time.sleep") as sleep:
+        result = ai_analyzer.analyze_with_vision("fakebase64")
+
+    assert result["description"] == "ok"
+    sleep.assert_called_once_with(1)
+
+
+def test_generate_stops_reading_after_complete_json():
+    text = 'Sure! {"description": "a {braced} \\"quote\\"", "tags": ["x"]} and then a long ramble'
+    resp = _stream_response(text, size=5)
+
+    with patch("ai_analyzer._SESSION.post", return_value=resp):
+        result = ai_analyzer._generate({}, timeout=1)
+
+    assert result == text[:text.index("}", text.index("tags")) + 1]
+    assert ai_analyzer.parse_ai_response(result)["description"] == 'a {braced} "quote"'
+    resp.close.assert_called_once()
+
+
+def test_generate_gzips_body_when_enabled():
+    with patch("ai_analyzer.config.OLLAMA_GZIP_REQUESTS", True), \
+         patch("ai_analyzer._SESSION.post", return_value=_stream_response("ok")) as post:
+        ai_analyzer._generate({"prompt": "p", "images": [b"QUJD"]}, timeout=1)
+
+    kwargs = post.call_args.kwargs
+    assert kwargs["headers"]["Content-Encoding"] == "gzip"
+    assert json.loads(gzip.decompress(kwargs["data"]))["images"] == ["QUJD"]
+
+
+def test_generate_reads_to_end_without_json():
+    with patch("ai_analyzer._SESSION.post", return_value=_stream_response("no json {here")):
+        assert ai_analyzer._generate({}, timeout=1) == "no json {here"
+
+
+# ── endpoint balancing ───────────────────────────────────────────────────────
+
+
+def test_acquire_endpoint_least_connections():
+    urls = ["http://a:11434", "http://b:11434"]
+    with patch("ai_analyzer.config.OLLAMA_BASE_URLS", urls):
+        first = ai_analyzer._acquire_endpoint()
+        second = ai_analyzer._acquire_endpoint()
+        assert {first, second} == set(urls)
+
+        ai_analyzer._release_endpoint(first)
+        assert ai_analyzer._acquire_endpoint() == first
+
+        ai_analyzer._release_endpoint(first)
+        ai_analyzer._release_endpoint(second)
+
+
+def test_generate_fails_over_before_backoff():
+    urls = ["http://dead:11434", "http://alive:11434"]
+    mock_resp = _stream_response("ok")
+
+    def fake_post(url, **kwargs):
+        if url.startswith("http://dead"):
+            raise requests.exceptions.ConnectionError
+        return mock_resp
+
+    with patch("ai_analyzer.config.OLLAMA_BASE_URLS", urls), \
+         patch("ai_analyzer._SESSION.post", side_effect=fake_post) as post, \
+         patch("ai_analyzer.time.sleep") as sleep:
+        for _ in range(3):
+            assert ai_analyzer._generate({}, timeout=1) == "ok"
+
+    sleep.assert_not_called()
+    # The dead host is tried at most once per call before failing over
+    assert post.call_count <= 6
 
 
 # ── refine_with_text_model ───────────────────────────────────────────────────
@@ -116,16 +243,15 @@ def test_refine_no_text_model():
 
 
 def test_refine_with_text_model():
-    mock_resp = MagicMock()
-    mock_resp.json.return_value = {
-        "response": '{"description": "Refined desc", "tags": ["refined"], "suggested_filename": "better.jpg"}'
-    }
-    mock_resp.raise_for_status = MagicMock()
+    mock_resp = _stream_response(
+        '{"description": "Refined desc", "tags": ["refined"], "suggested_filename": "better.jpg"}'
+    )
 
     with patch("ai_analyzer.config") as mock_config, \
-         patch("ai_analyzer.requests.post", return_value=mock_resp):
+         patch("ai_analyzer._SESSION.post", return_value=mock_resp):
         mock_config.TEXT_MODEL = "deepseek-r1:70b"
-        mock_config.OLLAMA_BASE_URL = "http://localhost:11434"
+        mock_config.OLLAMA_BASE_URLS = ["http://localhost:11434"]
+        mock_config.OLLAMA_MAX_RETRIES = 0
         result = ai_analyzer.refine_with_text_model("orig", ["t1"], "file.jpg")
 
     assert result["description"] == "Refined desc"
@@ -133,6 +259,59 @@ def test_refine_with_text_model():
     assert result["suggested_filename"] == "better.jpg"
 
 
+def test_refine_with_text_model_caches_repeat_requests():
+    mock_resp = _stream_response('{"description": "Refined", "tags": ["r"]}')
+
+    with patch("ai_analyzer.config.TEXT_MODEL", "deepseek-r1:70b"), \
+         patch("ai_analyzer.config.OLLAMA_MAX_RETRIES", 0), \
+         patch("ai_analyzer._SESSION.post", return_value=mock_resp) as post:
+        first = ai_analyzer.refine_with_text_model("orig ", ["b", "a"], "file.jpg")
+        first["tags"].append("mutated")
+        second = ai_analyzer.refine_with_text_model("orig", ["a", "b"], "file.jpg")
+
+    assert post.call_count == 1
+    assert second == {"description": "Refined", "tags": ["r"], "suggested_filename": None}
+
+
+def test_refine_with_text_model_does_not_cache_failures():
+    with patch("ai_analyzer.config.TEXT_MODEL", "deepseek-r1:70b"), \
+         patch("ai_analyzer.config.OLLAMA_MAX_RETRIES", 0), \
+         patch("ai_analyzer._SESSION.post", side_effect=requests.exceptions.ConnectionError) as post:
+        ai_analyzer.refine_with_text_model("orig", ["t1"], "file.jpg")
+        result = ai_analyzer.refine_with_text_model("orig", ["t1"], "file.jpg")
+
+    assert post.call_count == 2
+    assert result == {"description": "orig", "tags": ["t1"]}
+
+
+# ── analyze_path ─────────────────────────────────────────────────────────────
+
+
+def test_analyze_path_video_skips_near_identical_frames(tmp_path):
+    video = tmp_path / "clip.mp4"
+    video.write_bytes(b"fake")
+    gradient = Image.linear_gradient("L").convert("RGB")
+    checks = Image.new("RGB", (256, 256))
+    for x in range(0, 256, 64):
+        for y in range(0, 256, 64):
+            if (x + y) % 128 == 0:
+                checks.paste((255, 255, 255), (x, y, x + 64, y + 64))
+    frames = []
+    for i, img in enumerate([gradient, gradient, checks]):
+        path = tmp_path / f"frame_{i}.jpg"
+        img.save(str(path), format="JPEG")
+        frames.append(str(path))
+
+    with patch("ai_analyzer.scanner.extract_video_frames", return_value=frames), \
+         patch("ai_analyzer.analyze_with_vision",
+               return_value={"description": "frame", "tags": ["t"]}) as vision:
+        result = ai_analyzer.analyze_path(str(video), "video", "clip.mp4")
+
+    assert vision.call_count == 2
+    assert result["description"] == "frame | frame"
+    assert not any(os.path.exists(f) for f in frames)
+
+
 # ── rename_file ──────────────────────────────────────────────────────────────
 
 
@@ -151,6 +330,20 @@ def test_rename_file_success(db_conn, sample_image):
     assert not os.path.exists(result["old_path"])
 
 
+def test_rename_file_without_commit(db_conn, sample_image):
+    file_id = database.upsert_file(db_conn, {
+        "filepath": sample_image, "filename": os.path.basename(sample_image), "file_type": "image",
+    })
+    db_conn.commit()
+
+    result = ai_analyzer.rename_file(db_conn, file_id, "renamed.jpg", commit=False)
+
+    assert result["success"] is True
+    assert db_conn.in_transaction
+    db_conn.commit()
+    assert database.get_file_by_id(db_conn, file_id)["filename"] == "renamed.jpg"
+
+
 def test_rename_file_path_traversal(db_conn, sample_image):
     file_data = {
         "filepath": sample_image,
@@ -215,18 +408,262 @@ def test_analyze_all_unprocessed(db_conn, sample_image):
         database.upsert_file(db_conn, data)
     db_conn.commit()
 
-    call_count = 0
-
-    def mock_analyze_file(conn, file_id):
-        nonlocal call_count
-        call_count += 1
-        if call_count == 1:
+    def mock_analyze_path(filepath, file_type, filename):
+        if filepath == "/fake/a.jpg":
             return {"description": "ok", "tags": ["t"]}
         return {"error": "File not found on disk"}
 
-    with patch("ai_analyzer.analyze_file", side_effect=mock_analyze_file):
+    with patch("ai_analyzer.analyze_path", side_effect=mock_analyze_path):
         results = ai_analyzer.analyze_all_unprocessed(db_conn)
 
     assert results["total"] == 2  # junk excluded
     assert results["processed"] == 1
     assert results["errors"] == 1
+
+    # Results are written back on the caller's connection
+    row = db_conn.execute(
+        "SELECT description, ai_analyzed FROM files WHERE filepath = '/fake/a.jpg'"
+    ).fetchone()
+    assert row["description"] == "ok"
+    assert row["ai_analyzed"] == 1
+
+
+def test_analyze_all_unprocessed_progress(db_conn):
+    for name in ["a.jpg", "b.jpg", "c.jpg"]:
+        database.upsert_file(db_conn, {
+            "filepath": f"/fake/{name}", "filename": name, "file_type": "image",
+        })
+    db_conn.commit()
+
+    calls = []
+    with patch("ai_analyzer.analyze_path", return_value={"description": "d", "tags": []}):
+        ai_analyzer.analyze_all_unprocessed(
+            db_conn, progress_callback=lambda cur, total: calls.append((cur, total))
+        )
+
+    assert calls == [(1, 3), (2, 3), (3, 3)]
+
+
+def test_analyze_all_unprocessed_stops_when_ollama_unreachable(db_conn, tmp_path):
+    for i in range(10):
+        path = tmp_path / f"{i}.jpg"
+        Image.new("RGB", (8, 8)).save(str(path), format="JPEG")
+        database.upsert_file(db_conn, {
+            "filepath": str(path), "filename": path.name, "file_type": "image",
+        })
+    db_conn.commit()
+
+    with patch("ai_analyzer.config.ANALYZE_CONCURRENCY", 1), \
+         patch("ai_analyzer.config.OLLAMA_MAX_RETRIES", 0), \
+         patch("ai_analyzer._SESSION.post", side_effect=requests.exceptions.ConnectionError) as post:
+        results = ai_analyzer.analyze_all_unprocessed(db_conn)
+
+    assert results["aborted"] is True
+    assert results["processed"] == 0
+    # Only the already-queued window is attempted, not the whole backlog
+    assert post.call_count <= 2
+    assert db_conn.execute("SELECT COUNT(*) FROM files WHERE ai_analyzed = 1").fetchone()[0] == 0
+
+
+def test_analyze_all_unprocessed_bounded_window(db_conn):
+    for i in range(25):
+        database.upsert_file(db_conn, {
+            "filepath": f"/fake/{i}.jpg", "filename": f"{i}.jpg", "file_type": "image",
+        })
+    db_conn.commit()
+
+    lock = threading.Lock()
+    state = {"outstanding": 0, "peak": 0}
+
+    def finished(_future):
+        with lock:
+            state["outstanding"] -= 1
+
+    class CountingPool(ThreadPoolExecutor):
+        def submit(self, *args, **kwargs):
+            with lock:
+                state["outstanding"] += 1
+                state["peak"] = max(state["peak"], state["outstanding"])
+            future = super().submit(*args, **kwargs)
+            future.add_done_callback(finished)
+            return future
+
+    def slow_analyze(*_args):
+        time.sleep(0.01)
+        return {"description": "d", "tags": []}
+
+    with patch("ai_analyzer.config.ANALYZE_CONCURRENCY", 2), \
+         patch("ai_analyzer.ThreadPoolExecutor", CountingPool), \
+         patch("ai_analyzer.analyze_path", side_effect=slow_analyze) as ap:
+        results = ai_analyzer.analyze_all_unprocessed(db_conn)
+
+    assert results["processed"] == 25
+    assert ap.call_count == 25
+    assert 0 < state["peak"] <= 2 * 2
+    assert db_conn.execute("SELECT COUNT(*) FROM files WHERE ai_analyzed = 1").fetchone()[0] == 25
+
+
+@pytest.mark.slow
+def test_analyze_all_unprocessed_encodes_in_worker_processes(db_conn, sample_image):
+    database.upsert_file(db_conn, {
+        "filepath": sample_image, "filename": "a.jpg", "file_type": "image",
+    })
+    db_conn.commit()
+
+    mock_resp = _stream_response('{"description": "d", "tags": []}')
+    with patch("ai_analyzer.config.PREPROCESS_WORKERS", 1), \
+         patch("ai_analyzer._SESSION.post", return_value=mock_resp) as post:
+        results = ai_analyzer.analyze_all_unprocessed(db_conn)
+
+    assert results["processed"] == 1
+    sent = json.loads(post.call_args.kwargs["data"])["images"][0]
+    assert Image.open(io.BytesIO(base64.b64decode(sent))).format == "JPEG"
+
+
+# ── analysis cache ───────────────────────────────────────────────────────────
+
+
+def test_analyze_file_reuses_cached_analysis(db_conn, sample_image):
+    file_id = database.upsert_file(db_conn, {
+        "filepath": sample_image, "filename": os.path.basename(sample_image),
+        "file_type": "image", "file_hash": "h1",
+    })
+    database.cache_analysis(db_conn, "h1", ai_analyzer.config.VISION_MODEL, "cached desc", ["c"])
+    db_conn.commit()
+
+    with patch("ai_analyzer.analyze_path") as analyze_path:
+        result = ai_analyzer.analyze_file(db_conn, file_id)
+
+    analyze_path.assert_not_called()
+    assert result["description"] == "cached desc"
+    row = database.get_file_by_id(db_conn, file_id)
+    assert row["ai_analyzed"] == 1
+    assert json.loads(row["tags"]) == ["c"]
+
+
+def test_analyze_file_populates_cache(db_conn, sample_image):
+    file_id = database.upsert_file(db_conn, {
+        "filepath": sample_image, "filename": os.path.basename(sample_image),
+        "file_type": "image", "file_hash": "h2",
+    })
+    db_conn.commit()
+
+    with patch("ai_analyzer.analyze_path", return_value={"description": "fresh", "tags": ["f"]}):
+        ai_analyzer.analyze_file(db_conn, file_id)
+
+    cached = database.get_cached_analysis(db_conn, "h2", ai_analyzer.config.VISION_MODEL)
+    assert cached == {"description": "fresh", "tags": ["f"]}
+
+
+def test_analyze_file_hashes_unhashed_rows_for_cache(db_conn, sample_image):
+    file_id = database.upsert_file(db_conn, {
+        "filepath": sample_image, "filename": os.path.basename(sample_image), "file_type": "image",
+    })
+    db_conn.commit()
+
+    with patch("ai_analyzer.analyze_path", return_value={"description": "fresh", "tags": ["f"]}):
+        ai_analyzer.analyze_file(db_conn, file_id)
+
+    file_hash = database.get_file_by_id(db_conn, file_id)["file_hash"]
+    assert file_hash == scanner.compute_file_hash(sample_image)
+    assert database.get_cached_analysis(db_conn, file_hash, ai_analyzer.config.VISION_MODEL)
+
+
+def test_analyze_all_unprocessed_hashes_unhashed_rows_for_cache(db_conn, sample_image, tmp_path):
+    other = tmp_path / "other.jpg"
+    Image.new("RGB", (8, 8), color=(1, 2, 3)).save(str(other), format="JPEG")
+    for path in (sample_image, str(other)):
+        database.upsert_file(db_conn, {
+            "filepath": path, "filename": os.path.basename(path), "file_type": "image",
+        })
+    model = ai_analyzer.config.VISION_MODEL
+    database.cache_analysis(db_conn, scanner.compute_file_hash(sample_image), model, "cached", ["c"])
+    db_conn.commit()
+
+    with patch("ai_analyzer.analyze_path",
+               return_value={"description": "fresh", "tags": ["f"]}) as analyze_path:
+        results = ai_analyzer.analyze_all_unprocessed(db_conn)
+
+    # Only the uncached file reaches the model; both get their hash stored
+    assert results["processed"] == 2
+    assert [c.args[0] for c in analyze_path.call_args_list] == [str(other)]
+    rows = {r["filepath"]: r for r in db_conn.execute("SELECT * FROM files")}
+    assert rows[sample_image]["description"] == "cached"
+    other_hash = rows[str(other)]["file_hash"]
+    assert other_hash == scanner.compute_file_hash(str(other))
+    assert database.get_cached_analysis(db_conn, other_hash, model) == {
+        "description": "fresh", "tags": ["f"]}
+
+
+def test_analyze_all_unprocessed_copies_from_duplicate_original(db_conn, sample_image, tmp_path):
+    dup_path = tmp_path / "copy.jpg"
+    dup_path.write_bytes(open(sample_image, "rb").read())
+    orig_id = database.upsert_file(db_conn, {
+        "filepath": sample_image, "filename": "orig.jpg", "file_type": "image",
+        "description": "original desc", "tags": ["o"], "ai_analyzed": 1,
+    })
+    database.upsert_file(db_conn, {
+        "filepath": str(dup_path), "filename": "copy.jpg", "file_type": "image",
+        "is_duplicate": 1, "duplicate_of": orig_id,
+    })
+    db_conn.commit()
+
+    with patch("ai_analyzer.analyze_path") as analyze_path:
+        results = ai_analyzer.analyze_all_unprocessed(db_conn)
+
+    analyze_path.assert_not_called()
+    assert results == {"processed": 1, "errors": 0, "total": 1, "aborted": False}
+    row = db_conn.execute("SELECT description FROM files WHERE filepath = ?",
+                          (str(dup_path),)).fetchone()
+    assert row["description"] == "original desc"
+
+
+def test_failed_analysis_is_not_cached(db_conn, sample_image):
+    file_id = database.upsert_file(db_conn, {
+        "filepath": sample_image, "filename": os.path.basename(sample_image),
+        "file_type": "image", "file_hash": "h3",
+    })
+    db_conn.commit()
+
+    with patch("ai_analyzer.config.OLLAMA_MAX_RETRIES", 0), \
+         patch("ai_analyzer._SESSION.post", side_effect=requests.exceptions.ConnectionError) as post:
+        first = ai_analyzer.analyze_all_unprocessed(db_conn)
+        calls_after_first = post.call_count
+        database.upsert_file(db_conn, {"filepath": sample_image, "ai_analyzed": 0})
+        db_conn.commit()
+        second = ai_analyzer.analyze_all_unprocessed(db_conn)
+
+    assert first["errors"] == 1 and second["errors"] == 1
+    # The second run went back to the model instead of reusing the failure
+    assert post.call_count > calls_after_first
+    assert db_conn.execute("SELECT COUNT(*) FROM vision_cache").fetchone()[0] == 0
+    assert database.get_file_by_id(db_conn, file_id)["ai_analyzed"] == 0
+
+
+def test_analyze_all_unprocessed_one_call_per_hash(db_conn, sample_image, tmp_path):
+    copy_path = tmp_path / "copy.jpg"
+    copy_path.write_bytes(open(sample_image, "rb").read())
+    dup_path = tmp_path / "dup.jpg"
+    dup_path.write_bytes(open(sample_image, "rb").read())
+    orig_id = database.upsert_file(db_conn, {
+        "filepath": sample_image, "filename": "orig.jpg", "file_type": "image",
+        "file_hash": "same",
+    })
+    database.upsert_file(db_conn, {
+        "filepath": str(copy_path), "filename": "copy.jpg", "file_type": "image",
+        "file_hash": "same",
+    })
+    database.upsert_file(db_conn, {
+        "filepath": str(dup_path), "filename": "dup.jpg", "file_type": "image",
+        "is_duplicate": 1, "duplicate_of": orig_id,
+    })
+    db_conn.commit()
+
+    with patch("ai_analyzer.analyze_path",
+               return_value={"description": "shared", "tags": ["s"]}) as analyze_path:
+        results = ai_analyzer.analyze_all_unprocessed(db_conn)
+
+    assert analyze_path.call_count == 1
+    assert results == {"processed": 3, "errors": 0, "total": 3, "aborted": False}
+    descs = [r[0] for r in db_conn.execute("SELECT description FROM files")]
+    assert descs == ["shared"] * 3
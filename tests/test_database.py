@@ -17,6 +17,7 @@ def test_init_db_creates_tables(db_conn):
     names = {r["name"] for r in tables}
     assert "files" in names
     assert "files_fts" in names
+    assert "vision_cache" in names
 
     # Triggers
     triggers = db_conn.execute(
@@ -35,6 +36,14 @@ def test_init_db_creates_tables(db_conn):
     assert "idx_file_hash" in idx_names
     assert "idx_phash" in idx_names
     assert "idx_file_type" in idx_names
+    assert "idx_files_todo" in idx_names
+
+
+def test_unprocessed_query_uses_partial_index(db_conn):
+    plan = db_conn.execute(
+        "EXPLAIN QUERY PLAN SELECT id, filepath FROM files WHERE ai_analyzed = 0 AND is_junk = 0"
+    ).fetchall()
+    assert any("idx_files_todo" in row["detail"] for row in plan)
 
 
 # ── get_connection ───────────────────────────────────────────────────────────
@@ -57,6 +66,17 @@ def test_get_connection_contextmanager(tmp_path):
     verify.close()
 
 
+def test_get_connection_uses_wal(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    database.init_db(db_path).close()
+
+    with database.get_connection(db_path) as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+        assert conn.execute("PRAGMA temp_store").fetchone()[0] == 2  # MEMORY
+        assert conn.execute("PRAGMA mmap_size").fetchone()[0] == database._MMAP_SIZE
+
+
 def test_get_connection_rollback_on_error(tmp_path):
     db_path = str(tmp_path / "test.db")
     database.init_db(db_path).close()
@@ -73,6 +93,19 @@ def test_get_connection_rollback_on_error(tmp_path):
     verify.close()
 
 
+def test_connect_is_left_open_for_caller(tmp_path):
+    db_path = str(tmp_path / "test.db")
+    database.init_db(db_path).close()
+
+    conn = database.connect(db_path, check_same_thread=False)
+    assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+    conn.execute("INSERT INTO files (filepath, filename, file_type) VALUES (?, ?, ?)",
+                 ("/c.jpg", "c.jpg", "image"))
+    conn.commit()
+    assert database.get_file_by_id(conn, 1)["filename"] == "c.jpg"
+    conn.close()
+
+
 # ── upsert_file ──────────────────────────────────────────────────────────────
 
 
@@ -105,6 +138,38 @@ def test_upsert_serializes_lists(db_conn, sample_file_data):
     assert row["tags"] == json.dumps(["test", "photo"])
 
 
+def test_upsert_partial_update_keeps_other_columns(db_conn, sample_file_data):
+    file_id = database.upsert_file(db_conn, sample_file_data)
+    assert database.upsert_file(db_conn, {
+        "filepath": sample_file_data["filepath"], "description": "new", "ai_analyzed": 1,
+    }) == file_id
+
+    row = database.get_file_by_id(db_conn, file_id)
+    assert row["description"] == "new"
+    assert row["filename"] == sample_file_data["filename"]
+
+
+def test_upsert_partial_row_for_unknown_path_fails(db_conn):
+    with pytest.raises(sqlite3.IntegrityError):
+        database.upsert_file(db_conn, {"filepath": "/nope.jpg", "description": "x"})
+
+
+def test_upsert_files_bulk(db_conn, sample_file_data):
+    existing_id = database.upsert_file(db_conn, sample_file_data)
+    database.upsert_files_bulk(db_conn, [
+        {**sample_file_data, "file_size": 1},
+        {"filepath": "/new.jpg", "filename": "new.jpg", "file_type": "image", "tags": ["n"]},
+        {"filepath": "/new.jpg", "description": "partial"},
+    ])
+    db_conn.commit()
+
+    assert database.get_file_by_id(db_conn, existing_id)["file_size"] == 1
+    row = db_conn.execute("SELECT * FROM files WHERE filepath = '/new.jpg'").fetchone()
+    assert row["tags"] == json.dumps(["n"])
+    assert row["description"] == "partial"
+    assert db_conn.execute("SELECT COUNT(*) FROM files").fetchone()[0] == 2
+
+
 # ── search_files ─────────────────────────────────────────────────────────────
 
 
@@ -133,6 +198,20 @@ def test_search_files_type_filter(db_conn, sample_file_data):
     assert len(database.search_files(db_conn, "", file_type="video")) == 0
 
 
+def test_search_files_tag_filter(db_conn, sample_file_data):
+    database.upsert_file(db_conn, sample_file_data)
+    database.upsert_file(db_conn, {**sample_file_data, "filepath": "/other.jpg", "tags": ["other"]})
+
+    rows = database.search_files(db_conn, "", tag=" Photo ")
+    assert [r["filepath"] for r in rows] == [sample_file_data["filepath"]]
+    assert database.search_files(db_conn, "", tag="missing") == []
+
+    plan = db_conn.execute(
+        "EXPLAIN QUERY PLAN SELECT file_id FROM file_tags WHERE tag = 'photo'"
+    ).fetchall()
+    assert any("idx_ft_tag" in row["detail"] for row in plan)
+
+
 # ── get_stats ────────────────────────────────────────────────────────────────
 
 
@@ -154,6 +233,19 @@ def test_get_stats_with_data(db_conn, sample_file_data):
     assert stats["total_size"] == sample_file_data["file_size"]
 
 
+def test_get_stats_counts_flags(db_conn):
+    database.upsert_file(db_conn, {"filepath": "/a.jpg", "filename": "a.jpg", "file_type": "image",
+                                   "ai_analyzed": 1, "is_junk": 1})
+    database.upsert_file(db_conn, {"filepath": "/b.mp4", "filename": "b.mp4", "file_type": "video",
+                                   "is_duplicate": 1})
+    db_conn.commit()
+
+    assert database.get_stats(db_conn) == {
+        "total_files": 2, "images": 1, "videos": 1, "analyzed": 1,
+        "duplicates": 1, "junk": 1, "total_size": 0,
+    }
+
+
 # ── get_file_by_id ───────────────────────────────────────────────────────────
 
 
@@ -168,6 +260,15 @@ def test_get_file_by_id(db_conn, sample_file_data):
     assert database.get_file_by_id(db_conn, 9999) is None
 
 
+def test_get_files_by_ids(db_conn, sample_file_data):
+    first = database.upsert_file(db_conn, sample_file_data)
+    second = database.upsert_file(db_conn, {**sample_file_data, "filepath": "/other.jpg"})
+
+    rows = database.get_files_by_ids(db_conn, [second, 9999, first])
+    assert sorted(r["id"] for r in rows) == [first, second]
+    assert database.get_files_by_ids(db_conn, []) == []
+
+
 # ── get_all_tags ─────────────────────────────────────────────────────────────
 
 
@@ -186,19 +287,57 @@ def test_get_all_tags(db_conn, sample_file_data):
     assert tag_dict["landscape"] == 1
 
 
+def test_get_all_tags_skips_malformed(db_conn, sample_file_data):
+    database.upsert_file(db_conn, {**sample_file_data, "tags": [" Photo ", 3]})
+    db_conn.execute("INSERT INTO files (filepath, filename, file_type, tags) "
+                    "VALUES ('/bad.jpg', 'bad.jpg', 'image', 'not json')")
+    db_conn.commit()
+
+    assert database.get_all_tags(db_conn) == [("photo", 1)]
+
+
+def test_file_tags_follow_updates_and_deletes(db_conn, sample_file_data):
+    file_id = database.upsert_file(db_conn, {**sample_file_data, "tags": ["a", "B", "b"]})
+    tags = lambda: sorted(r[0] for r in db_conn.execute(
+        "SELECT tag FROM file_tags WHERE file_id = ?", (file_id,)))
+    assert tags() == ["a", "b"]
+
+    database.upsert_file(db_conn, {"filepath": sample_file_data["filepath"], "tags": ["c"]})
+    assert tags() == ["c"]
+
+    db_conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+    assert tags() == []
+
+
+def test_init_db_backfills_file_tags(tmp_path, sample_file_data):
+    db_path = str(tmp_path / "old.db")
+    conn = database.init_db(db_path)
+    database.upsert_file(conn, sample_file_data)
+    conn.execute("DROP TABLE file_tags")
+    conn.commit()
+    conn.close()
+
+    conn = database.init_db(db_path)
+    assert dict(database.get_all_tags(conn)) == {t: 1 for t in sample_file_data["tags"]}
+    conn.close()
+
+
 # ── get_duplicates ───────────────────────────────────────────────────────────
 
 
 def test_get_duplicates(db_conn, sample_file_data):
     orig_id = database.upsert_file(db_conn, sample_file_data)
     dup_data = {**sample_file_data, "filepath": "/dup.jpg", "filename": "dup.jpg",
-                "is_duplicate": 1, "duplicate_of": orig_id}
+                "original_filename": "camera.jpg", "is_duplicate": 1, "duplicate_of": orig_id}
     database.upsert_file(db_conn, dup_data)
     db_conn.commit()
 
     dups = database.get_duplicates(db_conn)
     assert len(dups) == 1
     assert dups[0]["original_filepath"] == sample_file_data["filepath"]
+    # The original's name, not the duplicate's own original_filename column
+    assert dups[0]["original_name"] == sample_file_data["filename"]
+    assert dups[0]["original_filename"] == "camera.jpg"
 
 
 # ── get_junk_files ───────────────────────────────────────────────────────────
@@ -213,3 +352,17 @@ def test_get_junk_files(db_conn, sample_file_data):
     junks = database.get_junk_files(db_conn)
     assert len(junks) == 1
     assert junks[0]["junk_reason"] == "very small (100 bytes)"
+
+
+# ── vision_cache ─────────────────────────────────────────────────────────────
+
+
+def test_cache_analysis_roundtrip(db_conn):
+    assert database.get_cached_analysis(db_conn, "h", "llava") is None
+
+    database.cache_analysis(db_conn, "h", "llava", "first", ["a"])
+    database.cache_analysis(db_conn, "h", "llava", "second", ["b"])
+    db_conn.commit()
+
+    assert database.get_cached_analysis(db_conn, "h", "llava") == {"description": "second", "tags": ["b"]}
+    assert database.get_cached_analysis(db_conn, "h", "other-model") is None
@@ -1,34 +1,60 @@
 """Tests for scanner.py."""
 import hashlib
+import json
 import os
+import random
 import subprocess
+from dataclasses import dataclass
+from types import SimpleNamespace
 from unittest.mock import patch, MagicMock
 
+import imagehash
+import numpy as np
 import pytest
-from PIL import Image
+from PIL import Image, ExifTags
 
 import scanner
 import database
 
 
-# ── get_file_type ────────────────────────────────────────────────────────────
+_TEST_CONTENT = b"deterministic content for hashing"
+_TEST_CONTENT_SHA256 = hashlib.sha256(_TEST_CONTENT).hexdigest()
+# Just over 2 MiB, so the last read chunk is partial
+_LARGE_CONTENT = bytes(range(256)) * (8 << 10) + b"tail"
+_LARGE_CONTENT_SHA256 = hashlib.sha256(_LARGE_CONTENT).hexdigest()
+
+# imagehash.phash of the rotated gradient PNG in the phash tests
+_GRADIENT_PHASH = "813d53bc5ba46b94"
+
+# What ffprobe prints for the first video stream's width and height
+_FFPROBE_STDOUT = json.dumps({"streams": [{"width": 1920, "height": 1080}]})
+
+
+@dataclass(frozen=True)
+class _FakeResult:
+    """Stand-in for subprocess.CompletedProcess in ffmpeg/ffprobe fakes."""
+    returncode: int
+    stdout: str = ""
+
 
+# Shared (immutable) results for the success paths of the fakes
+_OK = _FakeResult(0)
+_OK_DURATION = _FakeResult(0, "10.0")
 
-def test_get_file_type_image():
-    assert scanner.get_file_type("photo.jpg") == "image"
-    assert scanner.get_file_type("pic.PNG") == "image"
-    assert scanner.get_file_type("file.heic") == "image"
+
+# ── get_file_type ────────────────────────────────────────────────────────────
 
 
-def test_get_file_type_video():
-    assert scanner.get_file_type("clip.mp4") == "video"
-    assert scanner.get_file_type("movie.MOV") == "video"
-    assert scanner.get_file_type("vid.mkv") == "video"
+_EXPECTED_TYPES = {
+    "photo.jpg": "image", "pic.PNG": "image", "file.heic": "image",
+    "clip.mp4": "video", "movie.MOV": "video", "vid.mkv": "video",
+    "notes.txt": "unknown", "data.csv": "unknown",
+}
 
 
-def test_get_file_type_unknown():
-    assert scanner.get_file_type("notes.txt") == "unknown"
-    assert scanner.get_file_type("data.csv") == "unknown"
+@pytest.mark.parametrize("name,expected", _EXPECTED_TYPES.items())
+def test_get_file_type(name, expected):
+    assert scanner.get_file_type(name) == expected
 
 
 # ── discover_files ───────────────────────────────────────────────────────────
@@ -47,28 +73,73 @@ def test_discover_files(tmp_path):
     hidden_dir.mkdir()
     (hidden_dir / "secret.jpg").write_bytes(b"\xff\xd8")
 
-    found = list(scanner.discover_files(str(tmp_path)))
-    basenames = [os.path.basename(f) for f in found]
-    assert "photo.jpg" in basenames
-    assert "video.mp4" in basenames
-    assert "notes.txt" not in basenames
-    assert ".hidden.jpg" not in basenames
-    assert "secret.jpg" not in basenames
+    found = set(scanner.discover_files(str(tmp_path)))
+    assert found == {str(tmp_path / "photo.jpg"), str(tmp_path / "video.mp4")}
+
+
+def test_discover_files_recurses_without_following_dir_symlinks(tmp_path):
+    nested = tmp_path / "a" / "b"
+    nested.mkdir(parents=True)
+    (nested / "deep.png").write_bytes(b"\x89PNG")
+    (tmp_path / "link.png").symlink_to(nested / "deep.png")
+    (tmp_path / "loop").symlink_to(tmp_path, target_is_directory=True)
+
+    found = sorted(os.path.relpath(f, tmp_path) for f in scanner.discover_files(str(tmp_path)))
+    assert found == [os.path.join("a", "b", "deep.png"), "link.png"]
 
 
 # ── compute_file_hash ────────────────────────────────────────────────────────
 
 
-def test_compute_file_hash(tmp_path):
+@pytest.mark.parametrize("content,expected", [
+    (_TEST_CONTENT, _TEST_CONTENT_SHA256),
+    (_LARGE_CONTENT, _LARGE_CONTENT_SHA256),
+], ids=["small", "multi-chunk"])
+def test_compute_file_hash(tmp_path, content, expected):
     f = tmp_path / "data.bin"
-    content = b"deterministic content for hashing"
     f.write_bytes(content)
 
-    result = scanner.compute_file_hash(str(f))
-    expected = hashlib.sha256(content).hexdigest()
+    with patch("scanner._blake3", None):
+        result = scanner.compute_file_hash(str(f))
     assert result == expected
 
 
+def test_compute_file_hash_large_file_uses_mmap(tmp_path):
+    f = tmp_path / "big.bin"
+    content = os.urandom(5000)
+    f.write_bytes(content)
+
+    with patch("scanner._blake3", None), \
+         patch("scanner._MMAP_HASH_THRESHOLD", 1024), \
+         patch("scanner._MMAP_HASH_SLICE", 1500), \
+         patch("scanner._hash_mapped", wraps=scanner._hash_mapped) as mapped:
+        result = scanner.compute_file_hash(str(f))
+    mapped.assert_called_once()
+    assert result == hashlib.sha256(content).hexdigest()
+
+
+def test_compute_file_hash_without_file_digest(tmp_path):
+    f = tmp_path / "data.bin"
+    content = os.urandom((1 << 20) + 123)
+    f.write_bytes(content)
+
+    # A hashlib without file_digest, as on Python < 3.11
+    with patch("scanner._blake3", None), \
+         patch("scanner.hashlib", SimpleNamespace(sha256=hashlib.sha256)):
+        result = scanner.compute_file_hash(str(f))
+    assert result == hashlib.sha256(content).hexdigest()
+
+
+def test_compute_file_hash_tags_blake3(tmp_path):
+    f = tmp_path / "data.bin"
+    f.write_bytes(b"x" * (3 << 20))
+
+    # Any hashlib-style constructor stands in for the optional blake3 package
+    with patch("scanner._blake3", hashlib.blake2b):
+        result = scanner.compute_file_hash(str(f))
+    assert result == "blake3:" + hashlib.blake2b(b"x" * (3 << 20)).hexdigest()
+
+
 # ── compute_perceptual_hash ──────────────────────────────────────────────────
 
 
@@ -79,6 +150,25 @@ def test_compute_perceptual_hash(sample_image):
     assert len(result) == 16  # phash hex string length
 
 
+def test_compute_perceptual_hash_golden(tmp_path):
+    png = tmp_path / "gradient.png"
+    Image.linear_gradient("L").rotate(30).resize((300, 200)).save(str(png))
+    assert scanner.compute_perceptual_hash(str(png)) == _GRADIENT_PHASH
+
+
+@pytest.mark.slow
+def test_compute_perceptual_hash_matches_imagehash(tmp_path):
+    png = tmp_path / "gradient.png"
+    Image.linear_gradient("L").rotate(30).resize((300, 200)).save(str(png))
+    assert scanner.compute_perceptual_hash(str(png)) == str(imagehash.phash(Image.open(str(png))))
+
+    # JPEGs decode at reduced scale, which may nudge a few bits at most
+    jpg = tmp_path / "big.jpg"
+    Image.linear_gradient("L").rotate(30).resize((2400, 1600)).convert("RGB").save(str(jpg))
+    ours = imagehash.hex_to_hash(scanner.compute_perceptual_hash(str(jpg)))
+    assert ours - imagehash.phash(Image.open(str(jpg))) <= 4
+
+
 def test_compute_perceptual_hash_invalid(tmp_path):
     bad = tmp_path / "bad.jpg"
     bad.write_bytes(b"not an image")
@@ -88,12 +178,27 @@ def test_compute_perceptual_hash_invalid(tmp_path):
 # ── extract_exif ─────────────────────────────────────────────────────────────
 
 
-def test_extract_exif_no_exif(sample_rgba_image):
+def test_extract_exif_no_exif(tiny_rgba_image):
     """PNG files typically have no EXIF."""
-    exif = scanner.extract_exif(sample_rgba_image)
+    exif = scanner.extract_exif(tiny_rgba_image)
     assert exif == {}
 
 
+def test_extract_exif_reads_exif_ifd_without_maker_note(tmp_path):
+    path = tmp_path / "exif.jpg"
+    exif = Image.Exif()
+    exif[0x010F] = "TestCam"  # Make
+    exif_ifd = exif.get_ifd(ExifTags.IFD.Exif)
+    exif_ifd[0x9003] = "2024:01:02 03:04:05"  # DateTimeOriginal
+    exif_ifd[0x927C] = b"\x00" * 4096  # MakerNote
+    Image.new("RGB", (16, 16)).save(str(path), exif=exif)
+
+    data = scanner.extract_exif(str(path))
+    assert data["Make"] == "TestCam"
+    assert data["DateTimeOriginal"] == "2024:01:02 03:04:05"
+    assert "MakerNote" not in data
+
+
 # ── extract_image_metadata ───────────────────────────────────────────────────
 
 
@@ -109,25 +214,50 @@ def test_extract_image_metadata(sample_image):
     assert "scan_date" in data
 
 
+def test_extract_image_metadata_opens_image_once(tmp_path):
+    path = tmp_path / "exif.jpg"
+    exif = Image.Exif()
+    exif[0x010F] = "TestCam"  # Make
+    Image.new("RGB", (64, 48), color=(10, 20, 30)).save(str(path), exif=exif)
+
+    with patch("scanner.Image.open", wraps=Image.open) as image_open:
+        data = scanner.extract_image_metadata(str(path))
+
+    assert image_open.call_count == 1
+    assert (data["width"], data["height"]) == (64, 48)
+    assert json.loads(data["exif_data"])["Make"] == "TestCam"
+    assert ", " not in data["exif_data"] and '": ' not in data["exif_data"]
+    assert data["perceptual_hash"] == scanner.compute_perceptual_hash(str(path))
+
+
 # ── extract_video_metadata ───────────────────────────────────────────────────
 
 
-def test_extract_video_metadata(tmp_path):
-    video = tmp_path / "test.mp4"
-    video.write_bytes(b"\x00" * 1000)
+@pytest.fixture
+def fake_ffmpeg(monkeypatch):
+    """
+    Route scanner's subprocess.run to per-tool handlers (keyed by program
+    name, each taking the command list) and record every command.
+    """
+    fake = SimpleNamespace(calls=[], handlers={
+        "ffprobe": lambda cmd: _OK_DURATION,
+        "ffmpeg": lambda cmd: _OK,
+    })
 
-    ffprobe_output = {
-        "streams": [
-            {"codec_type": "video", "width": 1920, "height": 1080},
-            {"codec_type": "audio"},
-        ]
-    }
-    mock_result = MagicMock()
-    mock_result.returncode = 0
-    mock_result.stdout = __import__("json").dumps(ffprobe_output)
+    def run(cmd, **kwargs):
+        fake.calls.append(cmd)
+        return fake.handlers[cmd[0]](cmd)
 
-    with patch("scanner.subprocess.run", return_value=mock_result):
-        data = scanner.extract_video_metadata(str(video))
+    monkeypatch.setattr(scanner.subprocess, "run", run)
+    return fake
+
+
+def test_extract_video_metadata(tmp_path, make_sparse, fake_ffmpeg):
+    video = tmp_path / "test.mp4"
+    make_sparse(video, 1000)
+    fake_ffmpeg.handlers["ffprobe"] = lambda cmd: _FakeResult(0, _FFPROBE_STDOUT)
+
+    data = scanner.extract_video_metadata(str(video))
 
     assert data["file_type"] == "video"
     assert data["width"] == 1920
@@ -135,89 +265,88 @@ def test_extract_video_metadata(tmp_path):
     assert "file_hash" in data
 
 
+def test_extract_video_metadata_probes_in_process_with_pyav(tmp_path, make_sparse, fake_ffmpeg):
+    video = tmp_path / "test.mp4"
+    make_sparse(video, 1000)
+
+    container = MagicMock()
+    container.__enter__.return_value.streams.video = [SimpleNamespace(width=640, height=360)]
+    fake_av = MagicMock()
+    fake_av.open.return_value = container
+
+    with patch("scanner._av", fake_av):
+        data = scanner.extract_video_metadata(str(video))
+
+    assert fake_ffmpeg.calls == []
+    assert (data["width"], data["height"]) == (640, 360)
+
+
 # ── extract_video_frames ────────────────────────────────────────────────────
 
 
-def test_extract_video_frames(tmp_path):
+def test_extract_video_frames(tmp_path, make_sparse, fake_ffmpeg):
     video = tmp_path / "clip.mp4"
-    video.write_bytes(b"\x00" * 500)
-
-    def fake_run(cmd, **kwargs):
-        result = MagicMock()
-        result.returncode = 0
-        # ffprobe duration call
-        if "ffprobe" in cmd:
-            result.stdout = "10.0"
-            return result
-        # ffmpeg frame extraction — write dummy content to the output path
-        output_path = cmd[-1]
-        with open(output_path, "wb") as f:
-            f.write(b"\xff\xd8fake frame data")
-        return result
-
-    with patch("scanner.subprocess.run", side_effect=fake_run):
+    make_sparse(video, 500)
+
+    # Frames "written" by the fake ffmpeg; only their sizes are ever checked
+    written = set()
+
+    def ffmpeg(cmd):
+        written.update(arg for arg in cmd if arg.endswith(".jpg"))
+        return _OK
+
+    fake_ffmpeg.handlers["ffmpeg"] = ffmpeg
+    with patch("scanner.os.path.getsize", lambda p: 100 if p in written else 0):
         frames = scanner.extract_video_frames(str(video), num_frames=2)
 
     assert len(frames) == 2
+    # One ffprobe for the duration, then a single ffmpeg for all frames
+    ffmpeg_calls = [cmd for cmd in fake_ffmpeg.calls if cmd[0] == "ffmpeg"]
+    assert len(ffmpeg_calls) == 1
+    assert ffmpeg_calls[0].count("-i") == 2
+    assert set(frames) == written
     for fp in frames:
-        assert os.path.exists(fp)
-        os.unlink(fp)
+        os.unlink(fp)  # the (empty) temp files are real
 
 
-def test_extract_video_frames_cleanup_on_error(tmp_path):
+def test_extract_video_frames_cleanup_on_error(tmp_path, make_sparse, fake_ffmpeg):
     video = tmp_path / "clip.mp4"
-    video.write_bytes(b"\x00" * 500)
-
-    call_count = 0
-
-    def fake_run(cmd, **kwargs):
-        nonlocal call_count
-        call_count += 1
-        result = MagicMock()
-        result.returncode = 0
-        if "ffprobe" in cmd:
-            result.stdout = "10.0"
-            return result
-        # First ffmpeg succeeds, second raises
-        if call_count == 2:
-            output_path = cmd[-1]
-            with open(output_path, "wb") as f:
-                f.write(b"\xff\xd8data")
-            return result
-        raise subprocess.SubprocessError("ffmpeg crashed")
+    make_sparse(video, 500)
 
-    with patch("scanner.subprocess.run", side_effect=fake_run):
-        frames = scanner.extract_video_frames(str(video), num_frames=2)
-
-    # Should have at most 1 frame; any temp files from failed extractions cleaned up
-    assert len(frames) <= 1
-    for fp in frames:
-        os.unlink(fp)
+    outputs = []
 
+    def ffmpeg(cmd):
+        outputs.extend(arg for arg in cmd if arg.endswith(".jpg"))
+        raise subprocess.SubprocessError("ffmpeg crashed")
 
-# ── detect_junk ──────────────────────────────────────────────────────────────
+    fake_ffmpeg.handlers["ffmpeg"] = ffmpeg
+    frames = scanner.extract_video_frames(str(video), num_frames=2)
 
+    # No frames, and the temp files created for them are removed again
+    assert frames == []
+    assert len(outputs) == 2
+    assert not any(os.path.exists(p) for p in outputs)
 
-def test_detect_junk_small_file(sample_image):
-    is_junk, reason = scanner.detect_junk(sample_image, 500)
-    assert is_junk is True
-    assert "very small" in reason
 
+# ── detect_junk ──────────────────────────────────────────────────────────────
 
-def test_detect_junk_thumbnail_name(tmp_path):
-    thumb = tmp_path / "thumbnail_001.jpg"
-    img = Image.new("RGB", (50, 50), color=(0, 0, 0))
-    img.save(str(thumb), format="JPEG")
 
-    is_junk, reason = scanner.detect_junk(str(thumb), 100_000)
-    assert is_junk is True
-    assert "thumbnail" in reason.lower()
+@pytest.mark.parametrize("name,size,reason", [
+    ("test_photo.jpg", 500, "very small (500 bytes)"),
+    ("thumbnail_001.jpg", 100_000, "thumbnail/system file pattern"),
+    ("test_photo.jpg", 100_000, ""),
+])
+def test_detect_junk(sample_image, name, size, reason):
+    # A valid JPEG under the given name, so only size and name can flag it
+    path = os.path.join(os.path.dirname(sample_image), name)
+    os.replace(sample_image, path)
+    assert scanner.detect_junk(path, size) == (bool(reason), reason)
 
 
-def test_detect_junk_clean_file(sample_image):
-    is_junk, reason = scanner.detect_junk(sample_image, 100_000)
-    assert is_junk is False
-    assert reason == ""
+def test_detect_junk_skips_verify_for_decoded_image(sample_image):
+    with patch("scanner.Image.open") as image_open:
+        assert scanner.detect_junk(sample_image, 100_000, decode_ok=True) == (False, "")
+    image_open.assert_not_called()
 
 
 # ── find_duplicates ──────────────────────────────────────────────────────────
@@ -232,12 +361,150 @@ def test_find_duplicates(db_conn):
         "filepath": "/b.jpg", "filename": "b.jpg", "file_type": "image",
         "file_hash": "samehash", "file_size": 1000,
     }
-    database.upsert_file(db_conn, data1)
-    database.upsert_file(db_conn, data2)
-    db_conn.commit()
+    with db_conn:
+        database.upsert_file(db_conn, data1)
+        database.upsert_file(db_conn, data2)
 
     scanner.find_duplicates(db_conn)
 
-    dup = db_conn.execute("SELECT * FROM files WHERE is_duplicate = 1").fetchall()
+    dup = db_conn.execute("SELECT filepath FROM files WHERE is_duplicate = 1").fetchall()
     assert len(dup) == 1
-    assert dup[0]["filepath"] == "/b.jpg"
+    assert dup[0][0] == "/b.jpg"
+
+
+def test_find_duplicates_groups_by_hash(db_conn):
+    ids = {}
+    for name, h in [("a", "h1"), ("b", "h2"), ("c", "h1"), ("d", "h1"), ("e", "h2")]:
+        ids[name] = database.upsert_file(db_conn, {
+            "filepath": f"/{name}.jpg", "filename": f"{name}.jpg", "file_type": "image",
+            "file_hash": h,
+        })
+    db_conn.commit()
+
+    scanner.find_duplicates(db_conn)
+
+    dups = dict(db_conn.execute(
+        "SELECT id, duplicate_of FROM files WHERE is_duplicate = 1").fetchall())
+    assert dups == {ids["c"]: ids["a"], ids["d"]: ids["a"], ids["e"]: ids["b"]}
+    assert not db_conn.in_transaction
+
+
+def test_find_duplicates_perceptual(db_conn):
+    base = 0x0F0F_F0F0_3C3C_A5A5
+    # 8 flipped bits, two in every 16-bit chunk: the hardest case for bucketing
+    near = base ^ sum(1 << b for b in (0, 5, 20, 25, 36, 41, 52, 57))
+    far = base ^ 0x1FF  # 9 flipped bits
+    for name, h in [("a", base), ("b", far), ("c", near)]:
+        database.upsert_file(db_conn, {
+            "filepath": f"/{name}.jpg", "filename": f"{name}.jpg", "file_type": "image",
+            "perceptual_hash": f"{h:016x}",
+        })
+    db_conn.commit()
+
+    scanner.find_duplicates(db_conn)
+
+    rows = {r["filepath"]: r for r in db_conn.execute("SELECT * FROM files")}
+    assert rows["/b.jpg"]["is_duplicate"] == 0
+    assert rows["/c.jpg"]["is_duplicate"] == 1
+    assert rows["/c.jpg"]["duplicate_of"] == rows["/a.jpg"]["id"]
+
+
+def test_near_duplicate_pairs_matches_brute_force():
+    rng = random.Random(7)
+    hashes = [rng.getrandbits(64) for _ in range(200)]
+    # Plant near copies at every distance up to and just past the threshold
+    for d in range(0, 11):
+        src = rng.choice(hashes)
+        bits = rng.sample(range(64), d)
+        hashes.append(src ^ sum(1 << b for b in bits))
+
+    expected = {}
+    for j, h in enumerate(hashes):
+        for i in range(j):
+            if bin(hashes[i] ^ h).count("1") <= scanner.PHASH_DUPLICATE_DISTANCE:
+                expected[j] = i
+                break
+
+    assert dict(scanner._near_duplicate_pairs(hashes)) == expected
+
+
+def test_near_duplicate_pairs_folds_repeated_hashes():
+    far = (1 << 64) - 1
+    # Thousands of identical (blank-frame) hashes, one far away, one a bit off
+    hashes = [far, 0b101] + [0] * 5000 + [far, 0b1]
+    pairs = dict(scanner._near_duplicate_pairs(hashes))
+
+    # Every repeat and near copy pairs with the earliest close hash (index 1)
+    assert pairs == {**{j: 1 for j in range(2, 5002)}, 5002: 0, 5003: 1}
+
+
+@pytest.mark.parametrize("popcount", [scanner._popcount64, scanner._popcount64_swar])
+def test_popcount64(popcount):
+    values = [0, 1, 0xFFFFFFFFFFFFFFFF, 0x8000000000000001, 0x0123456789ABCDEF]
+    counts = popcount(np.array(values, dtype=np.uint64))
+    assert counts.tolist() == [bin(v).count("1") for v in values]
+
+
+# ── scan_directory ───────────────────────────────────────────────────────────
+
+
+def test_scan_directory(tmp_path):
+    media = tmp_path / "media"
+    media.mkdir()
+    for name, color in [("a.jpg", (255, 0, 0)), ("b.png", (0, 0, 255))]:
+        Image.new("RGB", (200, 200), color=color).save(str(media / name))
+    (media / "notes.txt").write_text("not media")
+    (media / "broken.jpg").write_bytes(b"not an image")
+    (media / "c.jpg").write_bytes((media / "a.jpg").read_bytes())
+
+    with patch("config.DB_PATH", str(tmp_path / "scan.db")):
+        stats = scanner.scan_directory(str(media))
+        with database.get_connection() as conn:
+            rows = {r["filename"]: r for r in conn.execute("SELECT * FROM files")}
+
+    assert stats["images"] == 4
+    assert rows["a.jpg"]["width"] == 200
+    assert rows["broken.jpg"]["is_junk"] == 1
+    assert "notes.txt" not in rows
+
+    # Only files sharing a size are hashed
+    assert rows["a.jpg"]["file_hash"] == rows["c.jpg"]["file_hash"] is not None
+    assert rows["c.jpg"]["duplicate_of"] == rows["a.jpg"]["id"]
+    assert rows["b.png"]["file_hash"] is None
+    assert len({r["scan_date"] for r in rows.values()}) == 1
+
+
+def test_scan_directory_hashes_sizes_shared_with_earlier_scans(tmp_path):
+    first, second = tmp_path / "first", tmp_path / "second"
+    first.mkdir()
+    second.mkdir()
+    Image.new("RGB", (64, 64), color=(9, 9, 9)).save(str(first / "a.png"))
+    (second / "copy.png").write_bytes((first / "a.png").read_bytes())
+
+    with patch("config.DB_PATH", str(tmp_path / "scan.db")):
+        scanner.scan_directory(str(first))
+        scanner.scan_directory(str(second))
+        with database.get_connection() as conn:
+            rows = {r["filename"]: r for r in conn.execute("SELECT * FROM files")}
+
+    assert rows["a.png"]["file_hash"] == rows["copy.png"]["file_hash"] is not None
+    assert rows["copy.png"]["duplicate_of"] == rows["a.png"]["id"]
+
+
+def test_rescan_keeps_hashes_of_unchanged_files(tmp_path):
+    Image.new("RGB", (64, 64), color=(9, 9, 9)).save(str(tmp_path / "a.png"))
+    Image.new("RGB", (32, 32), color=(1, 2, 3)).save(str(tmp_path / "b.png"))
+
+    with patch("config.DB_PATH", str(tmp_path / "scan.db")):
+        scanner.scan_directory(str(tmp_path))
+        with database.get_connection() as conn:
+            # Unique sizes aren't hashed by the scan; analysis hashes them lazily
+            conn.execute("UPDATE files SET file_hash = 'h-' || filename")
+
+        Image.new("RGB", (16, 16), color=(4, 5, 6)).save(str(tmp_path / "b.png"))
+        scanner.scan_directory(str(tmp_path))
+        with database.get_connection() as conn:
+            hashes = {r["filename"]: r["file_hash"] for r in conn.execute("SELECT * FROM files")}
+
+    # A changed file loses its stale hash; an unchanged one keeps it
+    assert hashes == {"a.png": "h-a.png", "b.png": None}